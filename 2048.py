@@ -6,8 +6,29 @@ Rohan Lewis
 
 November 2017 """
 
-import poc_2048_gui
+import asyncio
+import collections
+import itertools
+import json
+import math
+import mmap
+import multiprocessing
+import os
+import platform
 import random
+import statistics
+import struct
+import time
+
+try :
+    import numpy as np
+except ImportError :
+    np = None
+
+try :
+    import poc_2048_gui
+except ImportError :
+    poc_2048_gui = None
 
 # Directions, DO NOT MODIFY.
 UP = 1
@@ -40,20 +61,66 @@ def merge(line):
         new_list.append(0)
     return new_list    
 
+def merge_score(line):
+    """ Helper function that returns the points scored by merging a single row or
+    column, which is the sum of the tiles created by merges. """
+    score = 0
+    previous = 0
+    for item in line :
+        if item != 0 :
+            if item == previous :
+                score += 2 * item
+                previous = 0
+            else :
+                previous = item
+    return score
+
+def line_can_move(line):
+    """ Helper function that checks whether merge() would change a single row or
+    column, without building the merged line. """
+    seen_empty = False
+    previous = 0
+    for item in line :
+        if item == 0 :
+            seen_empty = True
+        elif seen_empty or item == previous :
+            return True
+        previous = item
+    return False
+
 class TwentyFortyEight :
     """ Class to run the game logic. """
 
-    def __init__(self, grid_height, grid_width):
+    def __init__(self, grid_height, grid_width, verbose=True, undo_limit=100):
         self._grid = {}
         self._height = grid_height
         self._width = grid_width
         self._merge_happened = False
+        self._score = 0
+        self._verbose = verbose
+        self._last_spawn = None
+        # Empty squares, with the index of each square in the list, so squares
+        # can be added and removed in constant time.
+        self._empty_cells = []
+        self._empty_index = {}
+        # Rows or columns that can move in each direction, and the rows and
+        # columns changed since they were last checked.
+        self._movable_lines = {UP : set(), DOWN : set(), LEFT : set(), RIGHT : set()}
+        self._dirty_rows = set()
+        self._dirty_cols = set()
+        # Row tuples shared with snapshots, and the rows changed since the
+        # last snapshot.
+        self._row_tuples = [None] * grid_height
+        self._stale_rows = set()
+        self._undo_states = collections.deque(maxlen=undo_limit)
         self.reset()
      
     def reset(self) :
         """ Reset the game so the grid is empty except for two initial tiles. """
-        for row in xrange(0, self._height) :
-            for col in xrange(0, self._width) :
+        self._score = 0
+        self._undo_states.clear()
+        for row in range(0, self._height) :
+            for col in range(0, self._width) :
                 self.set_tile(row, col, 0)
         self.new_tile()
         self.new_tile()
@@ -63,9 +130,9 @@ class TwentyFortyEight :
         Return a string representation of the grid for debugging.
         """
         str_array = ''
-        for row in xrange(0,self._height):
+        for row in range(0,self._height):
             temp_list = []
-            for col in xrange(0,self._width) :
+            for col in range(0,self._width) :
                 temp_list.append(self.get_tile(row,col))
             str_array += str(temp_list) +'\n'
         return str_array
@@ -78,14 +145,57 @@ class TwentyFortyEight :
         """ Get the width of the board. """
         return self._width
 
+    def get_score(self):
+        """ Get the sum of all tiles created by merges so far. """
+        return self._score
+
+    def snapshot(self):
+        """ Return an immutable BoardState of the board and score.  Rows that did
+        not change since the last snapshot are shared with it. """
+        for row in self._stale_rows :
+            self._row_tuples[row] = tuple([self._grid[(row, col)] for col in range(self._width)])
+        self._stale_rows.clear()
+        return BoardState(tuple(self._row_tuples), self._score)
+
+    def restore(self, state):
+        """ Set the board and score to those of a BoardState.  Only rows that
+        differ from the state are written. """
+        current_rows = self.snapshot().get_rows()
+        for row in range(self._height) :
+            state_row = state.get_rows()[row]
+            if state_row is not current_rows[row] :
+                for col in range(self._width) :
+                    if state_row[col] != current_rows[row][col] :
+                        self.set_tile(row, col, state_row[col])
+                self._row_tuples[row] = state_row
+                self._stale_rows.discard(row)
+        self._score = state.get_score()
+
+    def try_move(self, direction):
+        """ Return the BoardState after moving in the given direction, without
+        changing the game or adding a new tile. """
+        return self.snapshot().move(direction)
+
+    def can_undo(self):
+        """ Return True if there is a move to undo. """
+        return len(self._undo_states) > 0
+
+    def undo(self):
+        """ Go back to the board before the last move that changed it. """
+        if len(self._undo_states) > 0 :
+            self.restore(self._undo_states.pop())
+
     def move(self, direction):
         """ Move all tiles in the given direction and add a new tile if any tiles
-        moved. """
+        moved.  The board is only snapshotted for undo if undo_limit allows it. """
+        before_move = None
+        if self._undo_states.maxlen != 0 :
+            before_move = self.snapshot()
         if (direction == UP) or (direction == DOWN) :
             list_of_columns = []
-            for col in xrange(0,self._width) :
+            for col in range(0,self._width) :
                 a_column_list = []
-                for row in xrange(0,self._height) :
+                for row in range(0,self._height) :
                     a_column_list.append(self.get_tile(row,col))
                 list_of_columns.append(a_column_list)
             if direction == UP :
@@ -96,9 +206,9 @@ class TwentyFortyEight :
     
         else :
             list_of_rows = []
-            for row in xrange(0,self._height) :
+            for row in range(0,self._height) :
                 a_row_list = []
-                for col in xrange(0,self._width) :
+                for col in range(0,self._width) :
                     a_row_list.append(self.get_tile(row,col))
                 list_of_rows.append(a_row_list)
             if direction == LEFT :
@@ -108,7 +218,11 @@ class TwentyFortyEight :
             self.update_all_the_tiles(LEFT, list_of_rows)
         
         if self._merge_happened == True :
+            if before_move != None :
+                self._undo_states.append(before_move)
             self.new_tile()
+            if self._verbose and self.is_game_over() :
+                print ("Game Over!")
  
     def reverse_merge_reverse(self, list_of_lists) :       
         """ Helper function for down and right, as they require reversing before and
@@ -130,46 +244,1941 @@ class TwentyFortyEight :
         for a_list in list_of_lists :
             if a_list !=  merge(a_list) :
                 self._merge_happened = True
+                self._score += merge_score(a_list)
             a_list = merge(a_list)
             list_of_merged_lists.append(a_list)
         return list_of_merged_lists
     
     def update_all_the_tiles(self, direction, list_of_lists) :
         """ Helper function for move to update all values in the grid. """
-        for row in xrange(0,self._height) :
-            for col in xrange(0,self._width) :
+        for row in range(0,self._height) :
+            for col in range(0,self._width) :
                 if direction == UP :
                     self.set_tile(row, col, list_of_lists[col][row])
                 else :
                     self.set_tile(row, col, list_of_lists[row][col])
-        print str(self)
+        if self._verbose :
+            print(str(self))
     
     def new_tile(self):
         """ First checks that there are empty tiles.
         Then, creates a new tile in a randomly selected empty square.  The tile should
         be 2 90% of the time and 4 10% of the time. """
         
-        if 0 in self._grid.values() :
-            while True :
-                row = random.randrange(0, self._height)
-                col = random.randrange(0, self._width)
-                if self.get_tile(row, col) == 0 :
-                    spawned_value = 2
-                    rand_int = random.randrange(0,10)
-                    if rand_int == 4 :
-                        spawned_value = 4
-                    self.set_tile(row, col, spawned_value)
-                    return
-        else :
+        if len(self._empty_cells) > 0 :
+            row, col = random.choice(self._empty_cells)
+            spawned_value = 2
+            rand_int = random.randrange(0,10)
+            if rand_int == 4 :
+                spawned_value = 4
+            self.set_tile(row, col, spawned_value)
+            self._last_spawn = (row, col, spawned_value)
+        elif self._verbose :
             print ("Game Over!")
+
+    def get_last_spawn(self):
+        """ Return (row, col, value) of the last tile added by new_tile, or None. """
+        return self._last_spawn
+
+    def get_empty_cells(self):
+        """ Return the list of empty squares, in no particular order. """
+        return list(self._empty_cells)
+
+    def get_legal_moves(self):
+        """ Return the list of directions that would change the board.  Only the
+        rows and columns changed since the last call are checked again. """
+        for row in self._dirty_rows :
+            line = [self._grid[(row, col)] for col in range(self._width)]
+            self.update_movable_line(row, line, LEFT, RIGHT)
+        for col in self._dirty_cols :
+            line = [self._grid[(row, col)] for row in range(self._height)]
+            self.update_movable_line(col, line, UP, DOWN)
+        self._dirty_rows.clear()
+        self._dirty_cols.clear()
+        return [direction for direction in (UP, DOWN, LEFT, RIGHT)
+                if len(self._movable_lines[direction]) > 0]
+
+    def update_movable_line(self, index, line, forward, backward) :
+        """ Helper function for get_legal_moves to record whether a single row or
+        column can move forward (left or up) and backward (right or down). """
+        for direction, a_line in ((forward, line), (backward, line[::-1])) :
+            if line_can_move(a_line) :
+                self._movable_lines[direction].add(index)
+            else :
+                self._movable_lines[direction].discard(index)
+
+    def is_game_over(self):
+        """ Return True if no move would change the board. """
+        return len(self.get_legal_moves()) == 0
                
     def set_tile(self, row, col, value):
-        """ Set the tile at position row, col to have the given value. """
-        self._grid[(row, col)] = value
+        """ Set the tile at position row, col to have the given value.  Keeps the
+        empty square index up to date and marks the row and column as changed. """
+        cell = (row, col)
+        old_value = self._grid.get(cell)
+        self._grid[cell] = value
+        if old_value != value :
+            if value == 0 :
+                self._empty_index[cell] = len(self._empty_cells)
+                self._empty_cells.append(cell)
+            elif old_value == 0 :
+                # Swap the last empty square into this square's slot.
+                index = self._empty_index.pop(cell)
+                last_cell = self._empty_cells.pop()
+                if last_cell != cell :
+                    self._empty_cells[index] = last_cell
+                    self._empty_index[last_cell] = index
+            self._dirty_rows.add(row)
+            self._dirty_cols.add(col)
+            self._stale_rows.add(row)
         
     def get_tile(self, row, col):
         """ Return the value of the tile at position row, col. """
         return self._grid[(row, col)]
     
-poc_2048_gui.run_gui(TwentyFortyEight(4, 4))
+class BoardState :
+    """ Immutable snapshot of a TwentyFortyEight board: a tuple of row tuples and
+    the score.  Moving returns a new BoardState that shares every row the move
+    did not change, so search can branch without copying whole boards. """
+
+    def __init__(self, rows, score=0) :
+        self._rows = rows
+        self._score = score
+
+    def __str__(self) :
+        return ''.join([str(list(row)) + '\n' for row in self._rows])
+
+    def __eq__(self, other) :
+        return isinstance(other, BoardState) and self._rows == other._rows
+
+    def __ne__(self, other) :
+        return not self == other
+
+    def __hash__(self) :
+        return hash(self._rows)
+
+    def get_grid_height(self) :
+        """ Get the height of the board. """
+        return len(self._rows)
+
+    def get_grid_width(self) :
+        """ Get the width of the board. """
+        return len(self._rows[0])
+
+    def get_rows(self) :
+        """ Get the tuple of row tuples. """
+        return self._rows
+
+    def get_score(self) :
+        """ Get the score. """
+        return self._score
+
+    def get_tile(self, row, col) :
+        """ Return the value of the tile at position row, col. """
+        return self._rows[row][col]
+
+    def get_empty_cells(self) :
+        """ Return the list of empty squares. """
+        return [(row, col) for row in range(len(self._rows))
+                for col in range(len(self._rows[row])) if self._rows[row][col] == 0]
+
+    def with_tile(self, row, col, value) :
+        """ Return a BoardState with the tile at row, col set to value.  Only that
+        row is copied. """
+        new_rows = list(self._rows)
+        new_row = list(self._rows[row])
+        new_row[col] = value
+        new_rows[row] = tuple(new_row)
+        return BoardState(tuple(new_rows), self._score)
+
+    def move(self, direction) :
+        """ Return the BoardState after moving all tiles in the given direction,
+        without adding a new tile.  Returns self if nothing moved. """
+        rows = self._rows
+        score = self._score
+        new_rows = list(rows)
+        changed = False
+        if direction == LEFT or direction == RIGHT :
+            for index in range(len(rows)) :
+                line = list(rows[index])
+                if direction == RIGHT :
+                    line.reverse()
+                if line_can_move(line) :
+                    merged_line = merge(line)
+                    score += merge_score(line)
+                    if direction == RIGHT :
+                        merged_line.reverse()
+                    new_rows[index] = tuple(merged_line)
+                    changed = True
+        else :
+            width = len(rows[0])
+            for col in range(width) :
+                line = [row[col] for row in rows]
+                if direction == DOWN :
+                    line.reverse()
+                if line_can_move(line) :
+                    merged_line = merge(line)
+                    score += merge_score(line)
+                    if direction == DOWN :
+                        merged_line.reverse()
+                    for index in range(len(rows)) :
+                        if merged_line[index] != rows[index][col] :
+                            if new_rows[index] is rows[index] :
+                                new_rows[index] = list(rows[index])
+                            new_rows[index][col] = merged_line[index]
+                    changed = True
+            for index in range(len(rows)) :
+                if new_rows[index] is not rows[index] :
+                    new_rows[index] = tuple(new_rows[index])
+        if not changed :
+            return self
+        return BoardState(tuple(new_rows), score)
+
+
+##############################################################
+# Bitboard engine
+
+# A 4x4 board is stored as a single 64 bit integer.  Each tile is a 4 bit
+# nibble holding the log2 exponent of its value (0 for empty), so exponents
+# saturate at 15 (32768).  Row r occupies bits 16*r to 16*r + 15 and column c
+# is nibble c within its row.
+BITBOARD_SIZE = 4
+ROW_MASK = 0xFFFF
+COL_MASK = 0x000F000F000F000F
+
+def decode_row(row) :
+    """ Helper function that unpacks a 16 bit row into a list of tile values. """
+    line = []
+    for col in range(BITBOARD_SIZE) :
+        exponent = (row >> (4 * col)) & 0xF
+        if exponent == 0 :
+            line.append(0)
+        else :
+            line.append(1 << exponent)
+    return line
+
+def encode_row(line) :
+    """ Helper function that packs a list of tile values into a 16 bit row. """
+    row = 0
+    for col in range(BITBOARD_SIZE) :
+        if line[col] != 0 :
+            exponent = min(line[col].bit_length() - 1, 15)
+            row |= exponent << (4 * col)
+    return row
+
+def reverse_row(row) :
+    """ Helper function that reverses the order of the nibbles in a 16 bit row. """
+    return (((row & 0xF) << 12) | ((row & 0xF0) << 4) |
+            ((row >> 4) & 0xF0) | ((row >> 12) & 0xF))
+
+def spread_row(row) :
+    """ Helper function that spreads the nibbles of a 16 bit row down a column. """
+    return ((row & 0xF) | (((row >> 4) & 0xF) << 16) |
+            (((row >> 8) & 0xF) << 32) | (((row >> 12) & 0xF) << 48))
+
+def build_move_tables() :
+    """ Precompute the result of moving every possible row left and right, and
+    every possible column up and down, using merge() so the tables follow exactly
+    the same rules as TwentyFortyEight.  Columns are indexed by their nibbles
+    read top to bottom and stored spread out over column 0.  Also tabulates
+    merge_score(), which is the same in either direction along a line, and
+    whether a line would merge two 32768 tiles.  That happens in either
+    direction exactly when only empty squares lie between two of them, so
+    just those lines are marked rather than merging all of them again. """
+    row_left = [0] * (ROW_MASK + 1)
+    row_right = [0] * (ROW_MASK + 1)
+    col_up = [0] * (ROW_MASK + 1)
+    col_down = [0] * (ROW_MASK + 1)
+    row_score = [0] * (ROW_MASK + 1)
+    row_saturates = [False] * (ROW_MASK + 1)
+    for row in range(ROW_MASK + 1) :
+        line = decode_row(row)
+        moved = encode_row(merge(line))
+        reversed_row = reverse_row(row)
+        row_left[row] = moved
+        row_right[reversed_row] = reverse_row(moved)
+        col_up[row] = spread_row(moved)
+        col_down[reversed_row] = spread_row(reverse_row(moved))
+        row_score[row] = merge_score(line)
+    for first in range(BITBOARD_SIZE) :
+        for second in range(first + 1, BITBOARD_SIZE) :
+            others = [col for col in range(BITBOARD_SIZE) if col < first or col > second]
+            for exponents in itertools.product(range(16), repeat=len(others)) :
+                row = (0xF << (4 * first)) | (0xF << (4 * second))
+                for col, exponent in zip(others, exponents) :
+                    row |= exponent << (4 * col)
+                row_saturates[row] = True
+    return row_left, row_right, col_up, col_down, row_score, row_saturates
+
+# A nibble holds exponents up to 15, so 32768 is the largest tile.  A line whose
+# move would merge two of them (in either direction) cannot be represented, and
+# is marked in ROW_SATURATES.
+MAX_BITBOARD_TILE = 1 << 15
+ROW_LEFT, ROW_RIGHT, COL_UP, COL_DOWN, ROW_SCORE, ROW_SATURATES = build_move_tables()
+NIBBLE_LOW_BITS = 0x1111111111111111
+
+def bitboard_move(board, direction) :
+    """ Return the bitboard that results from moving all tiles of board in the
+    given direction.  No new tile is added. """
+    if direction == LEFT or direction == RIGHT :
+        if direction == LEFT :
+            table = ROW_LEFT
+        else :
+            table = ROW_RIGHT
+        return (table[board & ROW_MASK] |
+                (table[(board >> 16) & ROW_MASK] << 16) |
+                (table[(board >> 32) & ROW_MASK] << 32) |
+                (table[(board >> 48) & ROW_MASK] << 48))
+    if direction == UP :
+        table = COL_UP
+    else :
+        table = COL_DOWN
+    col0 = board & COL_MASK
+    col1 = (board >> 4) & COL_MASK
+    col2 = (board >> 8) & COL_MASK
+    col3 = (board >> 12) & COL_MASK
+    return (table[(col0 | (col0 >> 12) | (col0 >> 24) | (col0 >> 36)) & ROW_MASK] |
+            (table[(col1 | (col1 >> 12) | (col1 >> 24) | (col1 >> 36)) & ROW_MASK] << 4) |
+            (table[(col2 | (col2 >> 12) | (col2 >> 24) | (col2 >> 36)) & ROW_MASK] << 8) |
+            (table[(col3 | (col3 >> 12) | (col3 >> 24) | (col3 >> 36)) & ROW_MASK] << 12))
+
+def bitboard_score(board, direction) :
+    """ Return the points scored by moving all tiles of board in the given
+    direction. """
+    table = ROW_SCORE
+    if direction == LEFT or direction == RIGHT :
+        return (table[board & ROW_MASK] + table[(board >> 16) & ROW_MASK] +
+                table[(board >> 32) & ROW_MASK] + table[(board >> 48) & ROW_MASK])
+    col0 = board & COL_MASK
+    col1 = (board >> 4) & COL_MASK
+    col2 = (board >> 8) & COL_MASK
+    col3 = (board >> 12) & COL_MASK
+    return (table[(col0 | (col0 >> 12) | (col0 >> 24) | (col0 >> 36)) & ROW_MASK] +
+            table[(col1 | (col1 >> 12) | (col1 >> 24) | (col1 >> 36)) & ROW_MASK] +
+            table[(col2 | (col2 >> 12) | (col2 >> 24) | (col2 >> 36)) & ROW_MASK] +
+            table[(col3 | (col3 >> 12) | (col3 >> 24) | (col3 >> 36)) & ROW_MASK])
+
+def bitboard_saturates(board, direction) :
+    """ Return True if moving board in the given direction would merge two 32768
+    tiles, which a bitboard cannot hold. """
+    # Only boards with a nibble of all ones need the line lookups.
+    if board & (board >> 1) & (board >> 2) & (board >> 3) & NIBBLE_LOW_BITS == 0 :
+        return False
+    table = ROW_SATURATES
+    if direction == LEFT or direction == RIGHT :
+        return (table[board & ROW_MASK] or table[(board >> 16) & ROW_MASK] or
+                table[(board >> 32) & ROW_MASK] or table[(board >> 48) & ROW_MASK])
+    for shift in (0, 4, 8, 12) :
+        col = (board >> shift) & COL_MASK
+        if table[(col | (col >> 12) | (col >> 24) | (col >> 36)) & ROW_MASK] :
+            return True
+    return False
+
+def bitboard_empty_mask(board) :
+    """ Return a mask with the lowest bit of every empty nibble of a bitboard set,
+    found by folding each nibble onto its lowest bit. """
+    folded = board | (board >> 1)
+    folded |= folded >> 2
+    return ~folded & NIBBLE_LOW_BITS
+
+def bitboard_empty_cells(board) :
+    """ Return a list of the nibble indices of all empty tiles of a bitboard. """
+    empty_cells = []
+    mask = bitboard_empty_mask(board)
+    while mask :
+        low_bit = mask & -mask
+        empty_cells.append(low_bit.bit_length() >> 2)
+        mask ^= low_bit
+    return empty_cells
+
+class BitboardTwentyFortyEight :
+    """ Class to run the 4x4 game logic on a bitboard.  Same interface as
+    TwentyFortyEight, so it can be handed to the GUI directly. """
+
+    def __init__(self, grid_height=BITBOARD_SIZE, grid_width=BITBOARD_SIZE, verbose=True):
+        assert grid_height == BITBOARD_SIZE and grid_width == BITBOARD_SIZE, "Bitboard is 4x4 only."
+        self._height = grid_height
+        self._width = grid_width
+        self._board = 0
+        self._score = 0
+        self._verbose = verbose
+        self._last_spawn = None
+        self.reset()
+
+    def reset(self) :
+        """ Reset the game so the grid is empty except for two initial tiles. """
+        self._board = 0
+        self._score = 0
+        self.new_tile()
+        self.new_tile()
+
+    def __str__(self):
+        """
+        Return a string representation of the grid for debugging.
+        """
+        str_array = ''
+        for row in range(0, self._height) :
+            str_array += str(decode_row((self._board >> (16 * row)) & ROW_MASK)) + '\n'
+        return str_array
+
+    def get_grid_height(self):
+        """ Get the height of the board. """
+        return self._height
+
+    def get_grid_width(self):
+        """ Get the width of the board. """
+        return self._width
+
+    def get_score(self):
+        """ Get the sum of all tiles created by merges so far. """
+        return self._score
+
+    def get_board(self) :
+        """ Get the raw 64 bit board. """
+        return self._board
+
+    def set_board(self, board) :
+        """ Replace the raw 64 bit board. """
+        self._board = board
+
+    def move(self, direction):
+        """ Move all tiles in the given direction and add a new tile if any tiles
+        moved.  Raises OverflowError, leaving the game unchanged, if the move
+        would merge two 32768 tiles. """
+        moved_board = bitboard_move(self._board, direction)
+        if moved_board != self._board :
+            if bitboard_saturates(self._board, direction) :
+                raise OverflowError("Merging two 32768 tiles does not fit in a bitboard.")
+            self._score += bitboard_score(self._board, direction)
+            self._board = moved_board
+            self.new_tile()
+
+    def get_legal_moves(self):
+        """ Return the list of directions that would change the board, leaving
+        out moves that would merge two 32768 tiles. """
+        return [direction for direction in (UP, DOWN, LEFT, RIGHT)
+                if bitboard_move(self._board, direction) != self._board and
+                not bitboard_saturates(self._board, direction)]
+
+    def is_game_over(self):
+        """ Return True if no move would change the board. """
+        return len(self.get_legal_moves()) == 0
+
+    def new_tile(self):
+        """ Creates a new tile in a randomly selected empty square.  The tile should
+        be 2 90% of the time and 4 10% of the time. """
+        mask = bitboard_empty_mask(self._board)
+        if mask == 0 :
+            if self._verbose :
+                print("Game Over!")
+            return
+        # Pick the k-th empty nibble by clearing the k lowest bits of the mask.
+        for dummy_skip in range(random.randrange(bin(mask).count("1"))) :
+            mask &= mask - 1
+        index = (mask & -mask).bit_length() >> 2
+        exponent = 1
+        if random.randrange(0, 10) == 4 :
+            exponent = 2
+        self._board |= exponent << (4 * index)
+        self._last_spawn = (index // BITBOARD_SIZE, index % BITBOARD_SIZE, 1 << exponent)
+
+    def get_last_spawn(self):
+        """ Return (row, col, value) of the last tile added by new_tile, or None. """
+        return self._last_spawn
+
+    def set_tile(self, row, col, value):
+        """ Set the tile at position row, col to have the given value, which must
+        be 0 or a power of two from 2 to 32768. """
+        if value != 0 and (value < 2 or value > MAX_BITBOARD_TILE or value & (value - 1) != 0) :
+            raise ValueError("Bitboard tiles are 0 or powers of two from 2 to 32768, not " + str(value) + ".")
+        shift = 16 * row + 4 * col
+        exponent = 0
+        if value != 0 :
+            exponent = value.bit_length() - 1
+        self._board = (self._board & ~(0xF << shift)) | (exponent << shift)
+
+    def get_tile(self, row, col):
+        """ Return the value of the tile at position row, col. """
+        exponent = (self._board >> (16 * row + 4 * col)) & 0xF
+        if exponent == 0 :
+            return 0
+        return 1 << exponent
+
+##############################################################
+# Expectimax player
+
+# Heuristic weights for a single row or column, tuned for 4x4 play.
+LOST_PENALTY = 200000.0
+MONOTONICITY_POWER = 4.0
+MONOTONICITY_WEIGHT = 47.0
+SUM_POWER = 3.5
+SUM_WEIGHT = 11.0
+MERGES_WEIGHT = 700.0
+EMPTY_WEIGHT = 270.0
+
+HEURISTIC_TABLE = []
+
+def line_heuristic(exponents) :
+    """ Helper function that scores a single line of exponents.  Rewards empty
+    tiles, possible merges and monotonic lines, and penalizes large tiles. """
+    sum_score = 0.0
+    empty = 0
+    merges = 0
+    previous = 0
+    counter = 0
+    for exponent in exponents :
+        sum_score += exponent ** SUM_POWER
+        if exponent == 0 :
+            empty += 1
+        elif previous == exponent :
+            counter += 1
+        else :
+            if counter > 0 :
+                merges += 1 + counter
+            counter = 0
+            previous = exponent
+    if counter > 0 :
+        merges += 1 + counter
+
+    monotonicity_left = 0.0
+    monotonicity_right = 0.0
+    for index in range(1, len(exponents)) :
+        if exponents[index - 1] > exponents[index] :
+            monotonicity_left += (exponents[index - 1] ** MONOTONICITY_POWER -
+                                  exponents[index] ** MONOTONICITY_POWER)
+        else :
+            monotonicity_right += (exponents[index] ** MONOTONICITY_POWER -
+                                   exponents[index - 1] ** MONOTONICITY_POWER)
+
+    return (LOST_PENALTY + EMPTY_WEIGHT * empty + MERGES_WEIGHT * merges -
+            MONOTONICITY_WEIGHT * min(monotonicity_left, monotonicity_right) -
+            SUM_WEIGHT * sum_score)
+
+def build_heuristic_table() :
+    """ Precompute line_heuristic for every possible 16 bit row.  Only done once,
+    the first time a player needs it. """
+    if len(HEURISTIC_TABLE) == 0 :
+        for row in range(ROW_MASK + 1) :
+            exponents = [(row >> (4 * col)) & 0xF for col in range(BITBOARD_SIZE)]
+            HEURISTIC_TABLE.append(line_heuristic(exponents))
+    return HEURISTIC_TABLE
+
+def board_heuristic(board) :
+    """ Return the heuristic value of a bitboard, summed over rows and columns. """
+    table = HEURISTIC_TABLE
+    col0 = board & COL_MASK
+    col1 = (board >> 4) & COL_MASK
+    col2 = (board >> 8) & COL_MASK
+    col3 = (board >> 12) & COL_MASK
+    return (table[board & ROW_MASK] + table[(board >> 16) & ROW_MASK] +
+            table[(board >> 32) & ROW_MASK] + table[(board >> 48) & ROW_MASK] +
+            table[(col0 | (col0 >> 12) | (col0 >> 24) | (col0 >> 36)) & ROW_MASK] +
+            table[(col1 | (col1 >> 12) | (col1 >> 24) | (col1 >> 36)) & ROW_MASK] +
+            table[(col2 | (col2 >> 12) | (col2 >> 24) | (col2 >> 36)) & ROW_MASK] +
+            table[(col3 | (col3 >> 12) | (col3 >> 24) | (col3 >> 36)) & ROW_MASK])
+
+def game_to_bitboard(game) :
+    """ Return the bitboard for the tiles of any 4x4 game object. """
+    if hasattr(game, "get_board") :
+        return game.get_board()
+    assert game.get_grid_height() == BITBOARD_SIZE, "Bitboard is 4x4 only."
+    assert game.get_grid_width() == BITBOARD_SIZE, "Bitboard is 4x4 only."
+    board = 0
+    for row in range(BITBOARD_SIZE) :
+        for col in range(BITBOARD_SIZE) :
+            value = game.get_tile(row, col)
+            if value != 0 :
+                exponent = min(value.bit_length() - 1, 15)
+                board |= exponent << (16 * row + 4 * col)
+    return board
+
+class ExpectimaxPlayer :
+    """ Class that picks moves for a 4x4 game by depth-limited expectimax over the
+    2 (90%) and 4 (10%) spawns.  Searches by iterative deepening until max_depth
+    or the time budget (seconds per move) is reached.  Chance nodes whose
+    probability falls below probability_threshold are scored by the heuristic.
+    Chance node values are kept in an LRU cache of at most cache_size boards. """
+
+    def __init__(self, max_depth=3, time_budget=0.1,
+                 probability_threshold=0.0001, cache_size=200000) :
+        build_heuristic_table()
+        self._max_depth = max_depth
+        self._time_budget = time_budget
+        self._probability_threshold = probability_threshold
+        self._cache_size = cache_size
+        self._cache = collections.OrderedDict()
+        self._deadline = None
+        self._timed_out = False
+        self._nodes = 0
+        self._search_time = 0.0
+        self._cache_hits = 0
+        self._cache_lookups = 0
+        self._moves = 0
+
+    def choose_move(self, game) :
+        """ Return the best direction for the current game state, or None if no
+        move changes the board. """
+        return self.choose_board_move(game_to_bitboard(game))
+
+    def choose_board_move(self, board) :
+        """ Return the best direction for a bitboard, or None if no move changes
+        the board.  Moves that would merge two 32768 tiles are never chosen, as
+        the bitboard refuses them. """
+        start = time.time()
+        self._deadline = start + self._time_budget
+        self._timed_out = False
+
+        best_direction = None
+        for direction in (UP, DOWN, LEFT, RIGHT) :
+            if bitboard_move(board, direction) != board and not bitboard_saturates(board, direction) :
+                best_direction = direction
+                break
+
+        depth = 1
+        while best_direction != None and depth <= self._max_depth :
+            best_value = -1.0
+            depth_direction = None
+            for direction in (UP, DOWN, LEFT, RIGHT) :
+                moved_board = bitboard_move(board, direction)
+                if moved_board != board and not bitboard_saturates(board, direction) :
+                    value = self._chance_value(moved_board, depth - 1, 1.0)
+                    if value > best_value :
+                        best_value = value
+                        depth_direction = direction
+            if self._timed_out :
+                break
+            best_direction = depth_direction
+            depth += 1
+
+        self._search_time += time.time() - start
+        self._moves += 1
+        return best_direction
+
+    def play_move(self, game) :
+        """ Choose a move and apply it to the game.  Returns the direction, or
+        None if the game is over. """
+        direction = self.choose_move(game)
+        if direction != None :
+            game.move(direction)
+        return direction
+
+    def play_game(self, game, max_moves=None) :
+        """ Play moves until the game is over or max_moves have been made.
+        Returns the number of moves made. """
+        moves = 0
+        while max_moves == None or moves < max_moves :
+            if self.play_move(game) == None :
+                break
+            moves += 1
+        return moves
+
+    def _max_value(self, board, depth, probability) :
+        """ Value of a board where the player is to move. """
+        self._nodes += 1
+        if self._nodes & 0x3FF == 0 and time.time() > self._deadline :
+            self._timed_out = True
+        if self._timed_out :
+            return board_heuristic(board)
+        best_value = 0.0
+        for direction in (UP, DOWN, LEFT, RIGHT) :
+            moved_board = bitboard_move(board, direction)
+            if moved_board != board and not bitboard_saturates(board, direction) :
+                value = self._chance_value(moved_board, depth, probability)
+                if value > best_value :
+                    best_value = value
+        return best_value
+
+    def _chance_value(self, board, depth, probability) :
+        """ Value of a board where a tile is about to spawn, averaged over every
+        empty cell and both tile values. """
+        if depth == 0 or probability < self._probability_threshold or self._timed_out :
+            self._nodes += 1
+            return board_heuristic(board)
+
+        self._cache_lookups += 1
+        entry = self._cache.get(board)
+        if entry != None and entry[0] >= depth :
+            self._cache_hits += 1
+            self._cache.move_to_end(board)
+            return entry[1]
+
+        self._nodes += 1
+        empty_cells = bitboard_empty_cells(board)
+        num_empty = len(empty_cells)
+        two_probability = probability * 0.9 / num_empty
+        four_probability = probability * 0.1 / num_empty
+        total = 0.0
+        for index in empty_cells :
+            shift = 4 * index
+            total += 0.9 * self._max_value(board | (1 << shift), depth - 1, two_probability)
+            total += 0.1 * self._max_value(board | (2 << shift), depth - 1, four_probability)
+        value = total / num_empty
+
+        if not self._timed_out :
+            self._cache[board] = (depth, value)
+            self._cache.move_to_end(board)
+            if len(self._cache) > self._cache_size :
+                self._cache.popitem(last=False)
+        return value
+
+    def get_stats(self) :
+        """ Return a dictionary of search statistics: moves chosen, nodes searched,
+        nodes per second and cache hit rate. """
+        nodes_per_sec = 0.0
+        if self._search_time > 0 :
+            nodes_per_sec = self._nodes / self._search_time
+        hit_rate = 0.0
+        if self._cache_lookups > 0 :
+            hit_rate = float(self._cache_hits) / self._cache_lookups
+        return {"moves" : self._moves,
+                "nodes" : self._nodes,
+                "search_time" : self._search_time,
+                "nodes_per_sec" : nodes_per_sec,
+                "cache_hits" : self._cache_hits,
+                "cache_lookups" : self._cache_lookups,
+                "cache_hit_rate" : hit_rate,
+                "cache_size" : len(self._cache)}
+
+##############################################################
+# Headless self-play simulator
+
+def preview_move(game, direction) :
+    """ Return a tuple (changed, score, empty) describing what moving the game in
+    the given direction would do, without changing the game.  empty is the number
+    of empty tiles after the move, before a new tile is added. """
+    if hasattr(game, "get_board") :
+        board = game.get_board()
+        moved_board = bitboard_move(board, direction)
+        return (moved_board != board, bitboard_score(board, direction),
+                len(bitboard_empty_cells(moved_board)))
+
+    height = game.get_grid_height()
+    width = game.get_grid_width()
+    if direction == UP or direction == DOWN :
+        lines = [[game.get_tile(row, col) for row in range(height)]
+                 for col in range(width)]
+    else :
+        lines = [[game.get_tile(row, col) for col in range(width)]
+                 for row in range(height)]
+    changed = False
+    score = 0
+    empty = 0
+    for line in lines :
+        if direction == DOWN or direction == RIGHT :
+            line.reverse()
+        merged_line = merge(line)
+        if merged_line != line :
+            changed = True
+            score += merge_score(line)
+        empty += merged_line.count(0)
+    return (changed, score, empty)
+
+def legal_moves(game) :
+    """ Return the list of directions that change the board.  Empty when the game
+    is over. """
+    if hasattr(game, "get_legal_moves") :
+        return game.get_legal_moves()
+    moves = []
+    for direction in (UP, DOWN, LEFT, RIGHT) :
+        if preview_move(game, direction)[0] :
+            moves.append(direction)
+    return moves
+
+def random_policy(game, moves) :
+    """ Policy that picks a legal move uniformly at random. """
+    return random.choice(moves)
+
+def greedy_policy(game, moves) :
+    """ Policy that picks the legal move scoring the most points, breaking ties by
+    the number of empty tiles left and then by direction order. """
+    best_direction = None
+    best_key = None
+    for direction in moves :
+        dummy_changed, score, empty = preview_move(game, direction)
+        if best_key == None or (score, empty) > best_key :
+            best_key = (score, empty)
+            best_direction = direction
+    return best_direction
+
+POLICIES = {"random" : random_policy,
+            "greedy" : greedy_policy}
+
+def max_tile(game) :
+    """ Return the largest tile on the board. """
+    largest = 0
+    for row in range(game.get_grid_height()) :
+        for col in range(game.get_grid_width()) :
+            largest = max(largest, game.get_tile(row, col))
+    return largest
+
+def make_game(height, width) :
+    """ Return a quiet game of the given size, on the bitboard engine for 4x4. """
+    if height == BITBOARD_SIZE and width == BITBOARD_SIZE :
+        return BitboardTwentyFortyEight(height, width, verbose=False)
+    return TwentyFortyEight(height, width, verbose=False, undo_limit=0)
+
+def game_seed(seed, game_index) :
+    """ Seed for one game of a batch, so each game only depends on the batch seed
+    and its own index. """
+    return seed * 1000003 + game_index
+
+def play_one_game(task) :
+    """ Play a single headless game.  task is a tuple (game_index, seed, height,
+    width, policy, max_moves) and a dictionary of results is returned.  The global
+    random module is reseeded first, so the game only depends on its seed. """
+    game_index, seed, height, width, policy, max_moves = task
+    if policy in POLICIES :
+        policy = POLICIES[policy]
+    random.seed(seed)
+    start = time.time()
+    game = make_game(height, width)
+
+    moves = 0
+    while max_moves == None or moves < max_moves :
+        available = legal_moves(game)
+        if len(available) == 0 :
+            break
+        game.move(policy(game, available))
+        moves += 1
+
+    return {"game" : game_index,
+            "seed" : seed,
+            "score" : game.get_score(),
+            "max_tile" : max_tile(game),
+            "moves" : moves,
+            "time" : time.time() - start}
+
+def simulate_games(num_games, policy="random", seed=0, height=4, width=4,
+                   processes=None, output_path=None, max_moves=None) :
+    """ Play num_games headless games over a process pool and return a summary
+    dictionary.  policy is "random", "greedy" or a module level callable taking
+    (game, legal_moves) and returning a direction.  Each finished game is written
+    as one JSON line to output_path, in game order.  Records leave out the
+    wall-clock time of each game, which only adds to "game_time" in the summary,
+    so the file is the same for a given seed with any number of processes.
+    processes=1 plays in this process. """
+    tasks = [(game_index, game_seed(seed, game_index), height, width, policy, max_moves)
+             for game_index in range(num_games)]
+    start = time.time()
+    total_moves = 0
+    total_score = 0
+    total_game_time = 0.0
+    best_tile = 0
+    tile_counts = {}
+
+    output_file = None
+    if output_path != None :
+        output_file = open(output_path, "w")
+    pool = None
+    if processes == 1 :
+        results = map(play_one_game, tasks)
+    else :
+        pool = multiprocessing.Pool(processes)
+        chunk_size = max(1, num_games // (8 * (processes or multiprocessing.cpu_count())))
+        results = pool.imap(play_one_game, tasks, chunk_size)
+
+    try :
+        for result in results :
+            total_moves += result["moves"]
+            total_score += result["score"]
+            total_game_time += result.pop("time")
+            best_tile = max(best_tile, result["max_tile"])
+            tile_counts[result["max_tile"]] = tile_counts.get(result["max_tile"], 0) + 1
+            if output_file != None :
+                output_file.write(json.dumps(result, sort_keys=True) + "\n")
+                output_file.flush()
+    finally :
+        if pool != None :
+            pool.close()
+            pool.join()
+        if output_file != None :
+            output_file.close()
+
+    elapsed = time.time() - start
+    summary = {"games" : num_games,
+               "moves" : total_moves,
+               "elapsed" : elapsed,
+               "game_time" : total_game_time,
+               "games_per_sec" : 0.0,
+               "moves_per_sec" : 0.0,
+               "mean_score" : 0.0,
+               "max_tile" : best_tile,
+               "max_tile_counts" : tile_counts}
+    if elapsed > 0 :
+        summary["games_per_sec"] = num_games / elapsed
+        summary["moves_per_sec"] = total_moves / elapsed
+    if num_games > 0 :
+        summary["mean_score"] = float(total_score) / num_games
+    return summary
+
+##############################################################
+# Batched NumPy engine
+
+# Boards are (N, H, W) integer arrays of tile values, directions an N-vector
+# of UP, DOWN, LEFT and RIGHT.  Every move is turned into a merge to the left
+# of the lines of the board, then turned back.
+
+def batch_lines(boards, direction) :
+    """ Helper function that rearranges (N, H, W) boards so that moving in the
+    given direction is moving the lines along the last axis to the left. """
+    if direction == LEFT :
+        return boards
+    elif direction == RIGHT :
+        return boards[:, :, ::-1]
+    elif direction == UP :
+        return boards.transpose(0, 2, 1)
+    else :
+        return boards.transpose(0, 2, 1)[:, :, ::-1]
+
+def batch_unlines(lines, direction) :
+    """ Helper function that undoes batch_lines. """
+    if direction == LEFT :
+        return lines
+    elif direction == RIGHT :
+        return lines[:, :, ::-1]
+    elif direction == UP :
+        return lines.transpose(0, 2, 1)
+    else :
+        return lines[:, :, ::-1].transpose(0, 2, 1)
+
+def batch_compact(lines) :
+    """ Helper function that slides all nonzero tiles to the start of each line,
+    keeping their order. """
+    order = np.argsort(lines == 0, axis=-1, kind="stable")
+    return np.take_along_axis(lines, order, axis=-1)
+
+def batch_merge(lines) :
+    """ Vectorized merge() over the last axis of an array of lines.  Returns the
+    merged lines and the merge_score() of every line.  Within a run of equal
+    tiles, the tiles at even offsets from the start of the run merge with the
+    tile after them, which is the pairing merge() makes from the left. """
+    compacted = batch_compact(lines)
+    length = compacted.shape[-1]
+    positions = np.arange(length)
+    run_starts = np.ones(compacted.shape, dtype=bool)
+    run_starts[..., 1:] = compacted[..., 1:] != compacted[..., :-1]
+    run_start = np.maximum.accumulate(np.where(run_starts, positions, 0), axis=-1)
+    merging = np.zeros(compacted.shape, dtype=bool)
+    merging[..., :-1] = (((positions[:-1] - run_start[..., :-1]) % 2 == 0) &
+                         (compacted[..., :-1] != 0) &
+                         (compacted[..., :-1] == compacted[..., 1:]))
+    merged = np.where(merging, 2 * compacted, compacted)
+    merged[..., 1:][merging[..., :-1]] = 0
+    scores = np.where(merging, merged, 0).sum(axis=-1)
+    return batch_compact(merged), scores
+
+def batch_boards(boards) :
+    """ Helper function that turns boards (an array or nested lists) into an
+    int32 or int64 array.  Smaller integer types are widened to int64, as
+    doubling a tile could overflow them; other types raise TypeError. """
+    boards = np.asarray(boards)
+    if boards.dtype == np.int32 or boards.dtype == np.int64 :
+        return boards
+    if boards.dtype.kind in "iu" and boards.dtype.itemsize <= 4 :
+        return boards.astype(np.int64)
+    raise TypeError("Boards must be an integer array, not " + str(boards.dtype) + ".")
+
+def batch_move(boards, directions) :
+    """ Move every board of an (N, H, W) array in its own direction.  No new tiles
+    are added.  Returns the moved boards, an N-vector of flags telling which boards
+    changed and an N-vector of points scored. """
+    boards = batch_boards(boards)
+    directions = np.asarray(directions)
+    moved = boards.copy()
+    scores = np.zeros(len(boards), dtype=np.int64)
+    for direction in (UP, DOWN, LEFT, RIGHT) :
+        selected = np.nonzero(directions == direction)[0]
+        if len(selected) > 0 :
+            merged, line_scores = batch_merge(batch_lines(boards[selected], direction))
+            moved[selected] = batch_unlines(merged, direction)
+            scores[selected] = line_scores.sum(axis=-1)
+    changed = np.any(moved != boards, axis=(1, 2))
+    return moved, changed, scores
+
+def batch_spawn(boards, mask=None, rng=None) :
+    """ Return a copy of an (N, H, W) array of boards with one new tile in a random
+    empty square of every board selected by mask (all boards by default).  The
+    tile is 2 90% of the time and 4 10% of the time.  rng is a NumPy Generator. """
+    if rng is None :
+        rng = np.random.default_rng()
+    boards = batch_boards(boards)
+    num_boards, height, width = boards.shape
+    flat = boards.reshape(num_boards, height * width).copy()
+    keys = rng.random((num_boards, height * width))
+    keys[flat != 0] = -1.0
+    cells = np.argmax(keys, axis=1)
+    values = np.where(rng.random(num_boards) < 0.1, 4, 2)
+    spawning = np.any(flat == 0, axis=1)
+    if mask is not None :
+        spawning &= mask
+    selected = np.nonzero(spawning)[0]
+    flat[selected, cells[selected]] = values[selected]
+    return flat.reshape(boards.shape)
+
+def batch_step(boards, directions, rng=None) :
+    """ Batched TwentyFortyEight.move(): move every board in its own direction and
+    add a new tile to every board that changed.  Returns the new boards, the
+    changed flags and the points scored. """
+    moved, changed, scores = batch_move(boards, directions)
+    return batch_spawn(moved, changed, rng), changed, scores
+
+def verify_batch_move(num_boards=1000, height=4, width=4, seed=0) :
+    """ Check batch_step against TwentyFortyEight.move() on random boards.  The
+    scalar engine adds its own new tile, so exactly one square may differ, and
+    only on boards that changed.  Returns the number of boards checked. """
+    rng = np.random.default_rng(seed)
+    exponents = rng.integers(0, 6, size=(num_boards, height, width))
+    boards = np.where(exponents == 0, 0, 2 ** exponents)
+    directions = rng.integers(UP, RIGHT + 1, size=num_boards)
+    stepped, changed, scores = batch_step(boards, directions, rng)
+    moved = batch_move(boards, directions)[0]
+
+    game = TwentyFortyEight(height, width, verbose=False)
+    for index in range(num_boards) :
+        game.reset()
+        for row in range(height) :
+            for col in range(width) :
+                game.set_tile(row, col, int(boards[index, row, col]))
+        game.move(int(directions[index]))
+        assert game.get_score() == scores[index], "Score mismatch on board " + str(index)
+        differences = 0
+        for row in range(height) :
+            for col in range(width) :
+                if game.get_tile(row, col) != moved[index, row, col] :
+                    assert moved[index, row, col] == 0, "Tile mismatch on board " + str(index)
+                    differences += 1
+        assert differences == int(changed[index]), "Changed mismatch on board " + str(index)
+        assert np.count_nonzero(stepped[index]) == np.count_nonzero(moved[index]) + int(changed[index])
+    return num_boards
+
+##############################################################
+# Game records
+
+# A record is a small header followed by a bit stream, least significant bit
+# first.  The header is RECORD_HEADER: height, width, number of initial tiles
+# and number of plies.  The stream holds each initial tile as a square index
+# and a 5 bit exponent, then each ply as a 2 bit direction, the square index of
+# the new tile and 1 bit for its value (0 for 2, 1 for 4).  Square indices are
+# row * width + col, using just enough bits for the board, so a 4x4 ply takes 7
+# bits.  Only moves that changed the board are plies.
+RECORD_HEADER = struct.Struct("<BBHI")
+EXPONENT_BITS = 5
+
+# An archive is a data file of records appended back to back, and an index
+# file with one ARCHIVE_ENTRY per record: offset, length, plies, score and the
+# exponent of the largest tile.
+ARCHIVE_ENTRY = struct.Struct("<QIIQB")
+ARCHIVE_INDEX_SUFFIX = ".idx"
+
+def square_bits(height, width) :
+    """ Number of bits needed for a square index on a height x width board. """
+    return max(1, (height * width - 1).bit_length())
+
+def encode_game_record(height, width, initial_tiles, plies) :
+    """ Return the bytes of a record.  initial_tiles is a list of (row, col, value)
+    and plies a list of (direction, row, col, value) giving each move and the tile
+    it spawned. """
+    cell_bits = square_bits(height, width)
+    data = bytearray(RECORD_HEADER.pack(height, width, len(initial_tiles), len(plies)))
+    accumulator = 0
+    num_bits = 0
+    fields = []
+    for row, col, value in initial_tiles :
+        fields.append((row * width + col, cell_bits))
+        fields.append((value.bit_length() - 1, EXPONENT_BITS))
+    for direction, row, col, value in plies :
+        fields.append((direction - UP, 2))
+        fields.append((row * width + col, cell_bits))
+        fields.append((int(value == 4), 1))
+    for field, bits in fields :
+        accumulator |= field << num_bits
+        num_bits += bits
+        while num_bits >= 8 :
+            data.append(accumulator & 0xFF)
+            accumulator >>= 8
+            num_bits -= 8
+    if num_bits > 0 :
+        data.append(accumulator)
+    return bytes(data)
+
+def read_record_header(data) :
+    """ Return (height, width, num_initial, num_plies) of a record. """
+    return RECORD_HEADER.unpack_from(data, 0)
+
+def board_lines(height, width, direction) :
+    """ Helper function that returns, for a flat board, the list of square
+    indices of every row or column in the order the given direction merges it. """
+    if direction == LEFT :
+        return [[row * width + col for col in range(width)] for row in range(height)]
+    elif direction == RIGHT :
+        return [[row * width + col for col in range(width - 1, -1, -1)] for row in range(height)]
+    elif direction == UP :
+        return [[row * width + col for row in range(height)] for col in range(width)]
+    else :
+        return [[row * width + col for row in range(height - 1, -1, -1)] for col in range(width)]
+
+def tile_points(value) :
+    """ Points scored while building a tile of the given value out of 2s, which
+    is value * (log2(value) - 1). """
+    if value < 2 :
+        return 0
+    return value * (value.bit_length() - 2)
+
+def replay_game_record(data, ply=None) :
+    """ Rebuild the game stored in a record, up to and including the given ply
+    (all plies by default), without using any random numbers.  Returns a tuple
+    (tiles, score, plies) where tiles is a list of rows of tile values and plies is
+    the number of plies replayed. """
+    height, width, num_initial, num_plies = RECORD_HEADER.unpack_from(data, 0)
+    if ply == None or ply > num_plies :
+        ply = num_plies
+    cell_bits = square_bits(height, width)
+    cell_mask = (1 << cell_bits) - 1
+    tile_bits = cell_bits + EXPONENT_BITS
+    ply_bits = cell_bits + 3
+    ply_mask = (1 << ply_bits) - 1
+    # The stream is read 7 bytes at a time into an accumulator.
+    position = RECORD_HEADER.size
+    accumulator = 0
+    num_bits = 0
+
+    exponents = [0] * (height * width)
+    for dummy_tile in range(num_initial) :
+        if num_bits < tile_bits :
+            accumulator |= int.from_bytes(data[position:position + 7], "little") << num_bits
+            position += 7
+            num_bits += 56
+        exponents[accumulator & cell_mask] = (accumulator >> cell_bits) & 0x1F
+        accumulator >>= tile_bits
+        num_bits -= tile_bits
+
+    if height == BITBOARD_SIZE and width == BITBOARD_SIZE :
+        # Merges never change the sum of tile_points over the board, so the score
+        # follows from the last board, the initial tiles and the spawned 4s.
+        score = 0
+        board = 0
+        for index in range(BITBOARD_SIZE * BITBOARD_SIZE) :
+            if exponents[index] != 0 :
+                score -= tile_points(1 << exponents[index])
+                board |= min(exponents[index], 15) << (4 * index)
+        for dummy_ply in range(ply) :
+            if num_bits < ply_bits :
+                accumulator |= int.from_bytes(data[position:position + 7], "little") << num_bits
+                position += 7
+                num_bits += 56
+            field = accumulator & ply_mask
+            accumulator >>= ply_bits
+            num_bits -= ply_bits
+            board = bitboard_move(board, (field & 3) + UP)
+            board |= (1 + (field >> 6)) << (4 * ((field >> 2) & 0xF))
+            score -= 4 * (field >> 6)
+        tiles = [decode_row((board >> (16 * row)) & ROW_MASK) for row in range(BITBOARD_SIZE)]
+        for row in tiles :
+            for value in row :
+                score += tile_points(value)
+        return tiles, score, ply
+
+    score = 0
+    grid = [0] * (height * width)
+    for index in range(height * width) :
+        if exponents[index] != 0 :
+            grid[index] = 1 << exponents[index]
+    lines = {}
+    for direction in (UP, DOWN, LEFT, RIGHT) :
+        lines[direction] = board_lines(height, width, direction)
+    for dummy_ply in range(ply) :
+        if num_bits < ply_bits :
+            accumulator |= int.from_bytes(data[position:position + 7], "little") << num_bits
+            position += 7
+            num_bits += 56
+        field = accumulator & ply_mask
+        accumulator >>= ply_bits
+        num_bits -= ply_bits
+        for line in lines[(field & 3) + UP] :
+            values = [grid[index] for index in line]
+            merged_values = merge(values)
+            if merged_values != values :
+                score += merge_score(values)
+                for index, value in zip(line, merged_values) :
+                    grid[index] = value
+        grid[(field >> 2) & cell_mask] = 2 << (field >> (cell_bits + 2))
+    tiles = [grid[row * width:(row + 1) * width] for row in range(height)]
+    return tiles, score, ply
+
+class GameRecorder :
+    """ Class that plays moves on a game and records them.  Call move() instead of
+    game.move() and to_bytes() at the end to get the record. """
+
+    def __init__(self, game) :
+        self._game = game
+        self._initial_tiles = []
+        self._plies = []
+        for row in range(game.get_grid_height()) :
+            for col in range(game.get_grid_width()) :
+                if game.get_tile(row, col) != 0 :
+                    self._initial_tiles.append((row, col, game.get_tile(row, col)))
+
+    def get_game(self) :
+        """ Get the recorded game. """
+        return self._game
+
+    def get_num_plies(self) :
+        """ Get the number of plies recorded so far. """
+        return len(self._plies)
+
+    def move(self, direction) :
+        """ Move the game in the given direction and record the move and the tile
+        it spawned.  Moves that do not change the board are not recorded. """
+        if direction in self._game.get_legal_moves() :
+            self._game.move(direction)
+            row, col, value = self._game.get_last_spawn()
+            self._plies.append((direction, row, col, value))
+
+    def to_bytes(self) :
+        """ Return the record of the game so far. """
+        return encode_game_record(self._game.get_grid_height(), self._game.get_grid_width(),
+                                  self._initial_tiles, self._plies)
+
+class GameArchive :
+    """ Class for an append-only archive of game records at path, with an offset
+    index at path + ARCHIVE_INDEX_SUFFIX.  Reading memory-maps both files, so
+    queries only page in the records they touch. """
+
+    def __init__(self, path) :
+        self._path = path
+        self._data_map = None
+        self._index_map = None
+        self._data_size = 0
+        self._index_size = 0
+
+    def append(self, record) :
+        """ Replay a record to score it and add it to the end of the archive.
+        Returns the number of the record within the archive. """
+        tiles, score, plies = replay_game_record(record)
+        largest = max(max(row) for row in tiles)
+        with open(self._path, "ab") as data_file :
+            offset = data_file.tell()
+            data_file.write(record)
+        with open(self._path + ARCHIVE_INDEX_SUFFIX, "ab") as index_file :
+            number = index_file.tell() // ARCHIVE_ENTRY.size
+            index_file.write(ARCHIVE_ENTRY.pack(offset, len(record), plies, score,
+                                                max(largest, 1).bit_length() - 1))
+        return number
+
+    def append_recorder(self, recorder) :
+        """ Add the record of a GameRecorder to the archive. """
+        return self.append(recorder.to_bytes())
+
+    def open_maps(self) :
+        """ Helper function that memory-maps the archive files, or maps them again
+        if records were appended since.  A missing or empty archive is left
+        unmapped and has no records. """
+        data_size = 0
+        index_size = 0
+        if os.path.exists(self._path) and os.path.exists(self._path + ARCHIVE_INDEX_SUFFIX) :
+            data_size = os.path.getsize(self._path)
+            index_size = os.path.getsize(self._path + ARCHIVE_INDEX_SUFFIX)
+        if data_size != self._data_size or index_size != self._index_size :
+            self.close()
+            if data_size == 0 or index_size == 0 :
+                return
+            with open(self._path, "rb") as data_file :
+                self._data_map = mmap.mmap(data_file.fileno(), 0, access=mmap.ACCESS_READ)
+            with open(self._path + ARCHIVE_INDEX_SUFFIX, "rb") as index_file :
+                self._index_map = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._data_size = data_size
+            self._index_size = index_size
+
+    def close(self) :
+        """ Release the memory maps. """
+        if self._data_map != None :
+            self._data_map.close()
+            self._index_map.close()
+        self._data_map = None
+        self._index_map = None
+        self._data_size = 0
+        self._index_size = 0
+
+    def __len__(self) :
+        if not os.path.exists(self._path + ARCHIVE_INDEX_SUFFIX) :
+            return 0
+        return os.path.getsize(self._path + ARCHIVE_INDEX_SUFFIX) // ARCHIVE_ENTRY.size
+
+    def get_entry(self, number) :
+        """ Return the index entry of a record as a dictionary. """
+        self.open_maps()
+        if number < 0 or number >= self._index_size // ARCHIVE_ENTRY.size :
+            raise IndexError("No record " + str(number) + " in " + self._path + ".")
+        offset, length, plies, score, exponent = ARCHIVE_ENTRY.unpack_from(
+            self._index_map, number * ARCHIVE_ENTRY.size)
+        return {"offset" : offset, "length" : length, "plies" : plies,
+                "score" : score, "max_tile" : 1 << exponent}
+
+    def get_record(self, number) :
+        """ Return the bytes of a record. """
+        entry = self.get_entry(number)
+        return self._data_map[entry["offset"]:entry["offset"] + entry["length"]]
+
+    def replay(self, number, ply=None) :
+        """ Replay a record up to the given ply.  See replay_game_record. """
+        return replay_game_record(self.get_record(number), ply)
+
+    def find_games(self, min_tile=2048) :
+        """ Return the numbers of all records whose largest tile is at least
+        min_tile.  Only the index is read. """
+        self.open_maps()
+        matches = []
+        if self._index_map == None :
+            return matches
+        min_exponent = max(min_tile, 1).bit_length() - 1
+        for number in range(len(self._index_map) // ARCHIVE_ENTRY.size) :
+            exponent = self._index_map[number * ARCHIVE_ENTRY.size + ARCHIVE_ENTRY.size - 1]
+            if exponent >= min_exponent :
+                matches.append(number)
+        return matches
+
+    def verify(self, number) :
+        """ Replay a record and check its score and largest tile against the
+        index.  Returns True if they agree. """
+        entry = self.get_entry(number)
+        tiles, score, plies = self.replay(number)
+        largest = max(max(row) for row in tiles)
+        return (score == entry["score"] and plies == entry["plies"] and
+                largest == entry["max_tile"])
+
+##############################################################
+# N-tuple network
+
+# Each pattern is a tuple of 4x4 squares (row * 4 + col).  Its weight table
+# has one float for every combination of exponents on those squares, and is
+# shared by the pattern's 8 rotations and reflections.
+DEFAULT_PATTERNS = [(0, 1, 2, 3), (4, 5, 6, 7),
+                    (0, 1, 4, 5), (1, 2, 5, 6), (5, 6, 9, 10)]
+
+def symmetric_squares(square, symmetry) :
+    """ Helper function that maps a 4x4 square through one of the 8 rotations
+    and reflections of the board. """
+    row, col = square // BITBOARD_SIZE, square % BITBOARD_SIZE
+    last = BITBOARD_SIZE - 1
+    if symmetry & 4 :
+        row, col = col, row
+    if symmetry & 2 :
+        row = last - row
+    if symmetry & 1 :
+        col = last - col
+    return row * BITBOARD_SIZE + col
+
+class NTupleNetwork :
+    """ Class for an n-tuple network evaluating 4x4 afterstates.  The weights of
+    all patterns are one flat float32 table in the file at path, which is
+    memory-mapped, so several processes can share one copy and flush() is a
+    checkpoint.  The file is created, filled with zeros, if it is missing, and
+    an existing file of the wrong size raises ValueError. """
+
+    def __init__(self, path, patterns=None, readonly=False) :
+        if patterns == None :
+            patterns = DEFAULT_PATTERNS
+        self._path = path
+        self._patterns = [tuple(pattern) for pattern in patterns]
+        # One (table offset, list of bit shifts) per pattern and symmetry.
+        self._features = []
+        size = 0
+        for pattern in self._patterns :
+            for symmetry in range(8) :
+                shifts = [4 * symmetric_squares(square, symmetry) for square in pattern]
+                self._features.append((size, shifts))
+            size += 16 ** len(pattern)
+        self._size = size
+
+        if not os.path.exists(path) :
+            assert not readonly, "No weights file: " + path
+            with open(path, "wb") as weights_file :
+                weights_file.truncate(4 * size)
+        elif os.path.getsize(path) != 4 * size :
+            # Never resize an existing file: it may hold weights for other patterns.
+            raise ValueError("Weights file " + path + " has " + str(os.path.getsize(path)) +
+                             " bytes, the patterns need " + str(4 * size) + ".")
+        with open(path, "r+b" if not readonly else "rb") as weights_file :
+            if readonly :
+                self._map = mmap.mmap(weights_file.fileno(), 0, access=mmap.ACCESS_READ)
+            else :
+                self._map = mmap.mmap(weights_file.fileno(), 0, access=mmap.ACCESS_WRITE)
+        self._weights = memoryview(self._map).cast("f")
+
+    def get_patterns(self) :
+        """ Get the list of patterns. """
+        return list(self._patterns)
+
+    def get_size(self) :
+        """ Get the number of weights. """
+        return self._size
+
+    def feature_indices(self, board) :
+        """ Return the index into the weight table of every feature of a board. """
+        indices = []
+        for offset, shifts in self._features :
+            index = 0
+            for shift in shifts :
+                index = (index << 4) | ((board >> shift) & 0xF)
+            indices.append(offset + index)
+        return indices
+
+    def evaluate(self, board) :
+        """ Return the value of a bitboard afterstate. """
+        weights = self._weights
+        total = 0.0
+        for index in self.feature_indices(board) :
+            total += weights[index]
+        return total
+
+    def update(self, board, delta) :
+        """ Add delta to the value of a bitboard afterstate, spread evenly over
+        its features. """
+        weights = self._weights
+        step = delta / len(self._features)
+        for index in self.feature_indices(board) :
+            weights[index] += step
+
+    def best_move(self, board) :
+        """ Return (direction, reward, afterstate, value) of the move maximizing
+        reward plus afterstate value, or None if no move changes the board.
+        Moves that would merge two 32768 tiles are skipped. """
+        best = None
+        for direction in (UP, DOWN, LEFT, RIGHT) :
+            afterstate = bitboard_move(board, direction)
+            if afterstate != board and not bitboard_saturates(board, direction) :
+                reward = bitboard_score(board, direction)
+                value = self.evaluate(afterstate)
+                if best == None or reward + value > best[1] + best[3] :
+                    best = (direction, reward, afterstate, value)
+        return best
+
+    def flush(self) :
+        """ Write the weights back to the file. """
+        self._map.flush()
+
+    def close(self) :
+        """ Release the memory map. """
+        self._weights.release()
+        self._map.close()
+
+def train_ntuple(path, episodes, alpha=0.1, seed=0, patterns=None, report_every=0) :
+    """ Train the n-tuple network at path by TD(0) learning over afterstates for
+    the given number of self-play episodes, choosing every move greedily.
+    Afterstates come from the bitboard tables, which are built with merge().
+    alpha is split evenly over the features of an afterstate.  Progress is
+    printed every report_every episodes.  Returns a dictionary of statistics. """
+    network = NTupleNetwork(path, patterns)
+    random.seed(seed)
+    game = BitboardTwentyFortyEight(verbose=False)
+    start = time.time()
+    total_moves = 0
+    total_score = 0
+    tile_counts = {}
+    for episode in range(episodes) :
+        game.reset()
+        previous_afterstate = None
+        previous_value = 0.0
+        while True :
+            choice = network.best_move(game.get_board())
+            if choice == None :
+                break
+            direction, reward, afterstate, value = choice
+            if previous_afterstate != None :
+                network.update(previous_afterstate, alpha * (reward + value - previous_value))
+            previous_afterstate = afterstate
+            previous_value = network.evaluate(afterstate)
+            game.move(direction)
+            total_moves += 1
+        if previous_afterstate != None :
+            network.update(previous_afterstate, -alpha * previous_value)
+
+        total_score += game.get_score()
+        largest = max_tile(game)
+        tile_counts[largest] = tile_counts.get(largest, 0) + 1
+        if report_every > 0 and (episode + 1) % report_every == 0 :
+            elapsed = time.time() - start
+            print("Episode " + str(episode + 1) + ": " +
+                  str(round((episode + 1) / elapsed, 1)) + " episodes/sec, mean score " +
+                  str(round(float(total_score) / (episode + 1), 1)))
+    network.flush()
+    network.close()
+
+    elapsed = time.time() - start
+    stats = {"episodes" : episodes,
+             "moves" : total_moves,
+             "elapsed" : elapsed,
+             "episodes_per_sec" : 0.0,
+             "moves_per_sec" : 0.0,
+             "mean_score" : 0.0,
+             "max_tile_counts" : tile_counts}
+    if elapsed > 0 :
+        stats["episodes_per_sec"] = episodes / elapsed
+        stats["moves_per_sec"] = total_moves / elapsed
+    if episodes > 0 :
+        stats["mean_score"] = float(total_score) / episodes
+    return stats
+
+class NTuplePolicy :
+    """ Simulator policy that plays greedily with a trained n-tuple network.  Only
+    the path is pickled, so every worker process maps the weights file
+    read-only and shares it with the others. """
+
+    def __init__(self, path, patterns=None) :
+        self._path = path
+        self._patterns = patterns
+        self._network = None
+
+    def __getstate__(self) :
+        return {"_path" : self._path, "_patterns" : self._patterns, "_network" : None}
+
+    def __call__(self, game, moves) :
+        if self._network == None :
+            self._network = NTupleNetwork(self._path, self._patterns, readonly=True)
+        choice = self._network.best_move(game_to_bitboard(game))
+        if choice == None or choice[0] not in moves :
+            return moves[0]
+        return choice[0]
+
+def evaluate_ntuple(path, num_games, seed=0, patterns=None, processes=None, output_path=None) :
+    """ Play num_games 4x4 games greedily with the network at path, using
+    simulate_games.  Returns its summary. """
+    return simulate_games(num_games, NTuplePolicy(path, patterns), seed, BITBOARD_SIZE,
+                          BITBOARD_SIZE, processes, output_path)
+
+##############################################################
+# Game server
+
+# Requests and responses are single JSON objects, one per line.  Requests have
+# a "cmd" of "new", "move", "state", "close" or "stats", and may carry an "id"
+# that is echoed back.  Responses have "ok" and, on failure, "error".
+DIRECTION_NAMES = {"up" : UP, "down" : DOWN, "left" : LEFT, "right" : RIGHT}
+
+def percentiles(values, points=(50, 90, 99)) :
+    """ Return a dictionary of the given percentiles of a list of numbers, by the
+    nearest rank method. """
+    ordered = sorted(values)
+    result = {}
+    for point in points :
+        if len(ordered) == 0 :
+            result["p" + str(point)] = 0.0
+        else :
+            rank = int(math.ceil(point / 100.0 * len(ordered))) - 1
+            result["p" + str(point)] = ordered[max(0, rank)]
+    return result
+
+def game_state(game) :
+    """ Return a dictionary describing a game, for a server response. """
+    return {"tiles" : [[game.get_tile(row, col) for col in range(game.get_grid_width())]
+                       for row in range(game.get_grid_height())],
+            "score" : game.get_score(),
+            "legal_moves" : game.get_legal_moves()}
+
+class GameServer :
+    """ Class for an asyncio server running many independent game sessions.
+    Sessions idle for idle_timeout seconds are closed, at most max_sessions
+    are open and at most max_connections clients are served.  Each connection
+    handles one request at a time and waits for its response to drain before
+    reading the next, so slow readers hold back only themselves. """
+
+    def __init__(self, max_sessions=10000, idle_timeout=300.0,
+                 max_connections=1000, latency_samples=100000) :
+        self._max_sessions = max_sessions
+        self._idle_timeout = idle_timeout
+        self._max_connections = max_connections
+        self._sessions = {}
+        self._next_session = 1
+        self._connections = 0
+        self._handlers = set()
+        self._requests = 0
+        self._evicted = 0
+        self._latencies = collections.deque(maxlen=latency_samples)
+        self._server = None
+        self._evictor = None
+
+    async def start(self, host="127.0.0.1", port=2048, unix_path=None) :
+        """ Start listening on a TCP port, or on a Unix socket if unix_path is
+        given. """
+        if unix_path != None :
+            self._server = await asyncio.start_unix_server(self.handle_connection, unix_path)
+        else :
+            self._server = await asyncio.start_server(self.handle_connection, host, port)
+        self._evictor = asyncio.ensure_future(self.evict_idle_sessions())
+        return self._server
+
+    async def stop(self) :
+        """ Stop listening, disconnect all clients and drop all sessions. """
+        if self._evictor != None :
+            self._evictor.cancel()
+        if self._server != None :
+            self._server.close()
+        for handler in self._handlers :
+            handler.cancel()
+        await asyncio.gather(*self._handlers, return_exceptions=True)
+        if self._server != None :
+            await self._server.wait_closed()
+        self._sessions.clear()
+
+    def get_port(self) :
+        """ Return the TCP port the server listens on. """
+        return self._server.sockets[0].getsockname()[1]
+
+    async def evict_idle_sessions(self) :
+        """ Background task that closes sessions idle for longer than
+        idle_timeout. """
+        while True :
+            await asyncio.sleep(max(self._idle_timeout / 2.0, 0.01))
+            self.evict_idle_now()
+
+    def evict_idle_now(self) :
+        """ Close every session idle for longer than idle_timeout. """
+        cutoff = time.time() - self._idle_timeout
+        for session in [session for session, entry in self._sessions.items()
+                        if entry[1] < cutoff] :
+            del self._sessions[session]
+            self._evicted += 1
+
+    async def handle_connection(self, reader, writer) :
+        """ Serve one client in its own task, which stop() cancels.  Waiting on
+        it, rather than serving here, keeps a cancelled client out of the
+        server's connection callback. """
+        handler = asyncio.ensure_future(self.serve_client(reader, writer))
+        self._handlers.add(handler)
+        try :
+            await asyncio.wait([handler])
+        except asyncio.CancelledError :
+            handler.cancel()
+            raise
+        finally :
+            self._handlers.discard(handler)
+
+    async def serve_client(self, reader, writer) :
+        """ Serve requests from one client until it disconnects.  Cancellation is
+        passed on after the connection is closed. """
+        if self._connections >= self._max_connections :
+            writer.write((json.dumps({"ok" : False, "error" : "too many connections"}) + "\n").encode())
+            writer.close()
+            return
+        self._connections += 1
+        try :
+            while True :
+                line = await reader.readline()
+                if not line :
+                    break
+                start = time.time()
+                try :
+                    response = self.handle_request(line)
+                except Exception :
+                    # One bad request must not drop the connection.
+                    response = {"ok" : False, "error" : "internal error"}
+                writer.write((json.dumps(response) + "\n").encode())
+                self._latencies.append(time.time() - start)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError) :
+            pass
+        finally :
+            self._connections -= 1
+            writer.close()
+
+    def handle_request(self, line) :
+        """ Return the response dictionary for one request line. """
+        self._requests += 1
+        try :
+            request = json.loads(line)
+            command = request["cmd"]
+        except (ValueError, KeyError, TypeError) :
+            return {"ok" : False, "error" : "bad request"}
+        if not isinstance(request, dict) or not isinstance(command, str) :
+            return {"ok" : False, "error" : "bad request"}
+        if command == "new" :
+            response = self.new_session(request)
+        elif command == "stats" :
+            response = self.get_stats()
+        elif command in ("move", "state", "close") :
+            session = request.get("session")
+            entry = None
+            if isinstance(session, int) and not isinstance(session, bool) :
+                entry = self._sessions.get(session)
+            if entry == None :
+                response = {"ok" : False, "error" : "unknown session"}
+            elif command == "close" :
+                del self._sessions[request["session"]]
+                response = {"ok" : True}
+            else :
+                entry[1] = time.time()
+                response = self.session_request(entry[0], command, request)
+        else :
+            response = {"ok" : False, "error" : "unknown command"}
+        if "id" in request :
+            response["id"] = request["id"]
+        return response
+
+    def new_session(self, request) :
+        """ Open a session with a new game of the requested size. """
+        if len(self._sessions) >= self._max_sessions :
+            self.evict_idle_now()
+        if len(self._sessions) >= self._max_sessions :
+            return {"ok" : False, "error" : "too many sessions"}
+        height = request.get("height", 4)
+        width = request.get("width", 4)
+        if not (isinstance(height, int) and isinstance(width, int) and
+                1 <= height <= 64 and 1 <= width <= 64 and height * width > 1) :
+            return {"ok" : False, "error" : "bad size"}
+        session = self._next_session
+        self._next_session += 1
+        game = make_game(height, width)
+        self._sessions[session] = [game, time.time()]
+        response = {"ok" : True, "session" : session}
+        response.update(game_state(game))
+        return response
+
+    def session_request(self, game, command, request) :
+        """ Handle a move or state request on an open session. """
+        if command == "move" :
+            direction = request.get("direction")
+            if not isinstance(direction, (str, int)) or isinstance(direction, bool) :
+                return {"ok" : False, "error" : "bad direction"}
+            direction = DIRECTION_NAMES.get(direction, direction)
+            if direction not in (UP, DOWN, LEFT, RIGHT) :
+                return {"ok" : False, "error" : "bad direction"}
+            changed = direction in game.get_legal_moves()
+            if changed :
+                game.move(direction)
+            response = {"ok" : True, "changed" : changed}
+        else :
+            response = {"ok" : True}
+        response.update(game_state(game))
+        return response
+
+    def get_stats(self) :
+        """ Return server statistics, with request latencies in milliseconds. """
+        latencies = percentiles([1000.0 * latency for latency in self._latencies])
+        return {"ok" : True,
+                "sessions" : len(self._sessions),
+                "connections" : self._connections,
+                "requests" : self._requests,
+                "evicted" : self._evicted,
+                "latency_ms" : latencies}
+
+def run_server(host="127.0.0.1", port=2048, unix_path=None, **options) :
+    """ Run a GameServer until interrupted.  options are passed to GameServer. """
+    async def serve() :
+        server = GameServer(**options)
+        listener = await server.start(host, port, unix_path)
+        async with listener :
+            await listener.serve_forever()
+    asyncio.run(serve())
+
+async def load_client(host, port, unix_path, num_requests, latencies) :
+    """ One load generator connection: opens a session and sends num_requests
+    random moves, one at a time, recording the latency of each. """
+    if unix_path != None :
+        reader, writer = await asyncio.open_unix_connection(unix_path)
+    else :
+        reader, writer = await asyncio.open_connection(host, port)
+    writer.write(b'{"cmd": "new"}\n')
+    session = json.loads(await reader.readline())["session"]
+    for dummy_request in range(num_requests) :
+        request = {"cmd" : "move", "session" : session,
+                   "direction" : random.choice((UP, DOWN, LEFT, RIGHT))}
+        start = time.time()
+        writer.write((json.dumps(request) + "\n").encode())
+        response = json.loads(await reader.readline())
+        latencies.append(time.time() - start)
+        if response["ok"] and len(response["legal_moves"]) == 0 :
+            writer.write((json.dumps({"cmd" : "close", "session" : session}) + "\n").encode())
+            await reader.readline()
+            writer.write(b'{"cmd": "new"}\n')
+            session = json.loads(await reader.readline())["session"]
+    writer.write((json.dumps({"cmd" : "close", "session" : session}) + "\n").encode())
+    await reader.readline()
+    writer.close()
+    await writer.wait_closed()
+
+async def load_test(host="127.0.0.1", port=2048, unix_path=None,
+                    connections=100, requests_per_connection=1000) :
+    """ Drive a running GameServer with many concurrent connections.  Returns a
+    dictionary with requests/sec, client side latency percentiles and the
+    server's own stats. """
+    latencies = []
+    start = time.time()
+    await asyncio.gather(*[load_client(host, port, unix_path, requests_per_connection, latencies)
+                           for dummy_connection in range(connections)])
+    elapsed = time.time() - start
+
+    if unix_path != None :
+        reader, writer = await asyncio.open_unix_connection(unix_path)
+    else :
+        reader, writer = await asyncio.open_connection(host, port)
+    writer.write(b'{"cmd": "stats"}\n')
+    server_stats = json.loads(await reader.readline())
+    writer.close()
+    await writer.wait_closed()
+
+    return {"requests" : len(latencies),
+            "elapsed" : elapsed,
+            "requests_per_sec" : len(latencies) / elapsed if elapsed > 0 else 0.0,
+            "latency_ms" : percentiles([1000.0 * latency for latency in latencies]),
+            "server" : server_stats}
+
+def run_load_test(**options) :
+    """ Run load_test against a running server and return its results. """
+    return asyncio.run(load_test(**options))
+
+##############################################################
+# Benchmarks
+
+BENCHMARK_SIZES = (4, 8, 32)
+DIRECTION_LABELS = {UP : "up", DOWN : "down", LEFT : "left", RIGHT : "right"}
+
+def random_line(length, fill=0.5) :
+    """ Return a random line of tiles, each square full with probability fill. """
+    line = []
+    for dummy_col in range(length) :
+        if random.random() < fill :
+            line.append(2 ** random.randint(1, 6))
+        else :
+            line.append(0)
+    return line
+
+def random_board_state(size, fill=0.5) :
+    """ Return a BoardState of a random size x size board. """
+    return BoardState(tuple([tuple(random_line(size, fill)) for dummy_row in range(size)]))
+
+def near_full_board_state(size, num_empty=1) :
+    """ Return a BoardState of a size x size board with num_empty empty squares
+    and no possible merges. """
+    rows = [[2 ** (1 + (row + col) % 2) for col in range(size)] for row in range(size)]
+    for index in random.sample(range(size * size), num_empty) :
+        rows[index // size][index % size] = 0
+    return BoardState(tuple([tuple(row) for row in rows]))
+
+def benchmark_case(run_once, repeats, min_time) :
+    """ Helper function that calls run_once, which returns (operations, seconds
+    timed), until min_time seconds are timed, repeats times.  Returns the
+    operations per second of every repeat, with their mean and standard
+    deviation. """
+    samples = []
+    for dummy_repeat in range(repeats) :
+        operations = 0
+        elapsed = 0.0
+        while elapsed < min_time :
+            batch_operations, batch_time = run_once()
+            operations += batch_operations
+            elapsed += batch_time
+        samples.append(operations / elapsed)
+    stdev = 0.0
+    if len(samples) > 1 :
+        stdev = statistics.stdev(samples)
+    return {"ops_per_sec" : statistics.mean(samples), "stdev" : stdev, "samples" : samples}
+
+def benchmark_merge(size) :
+    """ Benchmark case for merge() on random lines of the given length. """
+    lines = [random_line(size) for dummy_line in range(1000)]
+    def run_once() :
+        start = time.perf_counter()
+        for line in lines :
+            merge(line)
+        return len(lines), time.perf_counter() - start
+    return run_once
+
+def benchmark_move(size, direction) :
+    """ Benchmark case for TwentyFortyEight.move() on random boards.  The board is
+    restored before every move, outside the timed part. """
+    states = [random_board_state(size) for dummy_state in range(16)]
+    game = TwentyFortyEight(size, size, verbose=False, undo_limit=0)
+    counter = [0]
+    def run_once() :
+        game.restore(states[counter[0] % len(states)])
+        counter[0] += 1
+        start = time.perf_counter()
+        game.move(direction)
+        return 1, time.perf_counter() - start
+    return run_once
+
+def benchmark_new_tile(size) :
+    """ Benchmark case for TwentyFortyEight.new_tile() on boards with one empty
+    square. """
+    state = near_full_board_state(size)
+    game = TwentyFortyEight(size, size, verbose=False, undo_limit=0)
+    def run_once() :
+        game.restore(state)
+        start = time.perf_counter()
+        game.new_tile()
+        return 1, time.perf_counter() - start
+    return run_once
+
+def run_benchmarks(sizes=BENCHMARK_SIZES, repeats=5, min_time=0.2, seed=0) :
+    """ Benchmark merge, move in each direction and new_tile on square boards of
+    each size.  Every case is reseeded, so the inputs are the same from run to
+    run.  Returns a dictionary with run information and a "results" dictionary
+    keyed by "case/HxW". """
+    results = {}
+    for size in sizes :
+        cases = [("merge", benchmark_merge, (size,))]
+        for direction in (UP, DOWN, LEFT, RIGHT) :
+            cases.append(("move_" + DIRECTION_LABELS[direction], benchmark_move, (size, direction)))
+        cases.append(("new_tile", benchmark_new_tile, (size,)))
+        for name, make_case, arguments in cases :
+            random.seed(seed)
+            key = name + "/" + str(size) + "x" + str(size)
+            results[key] = benchmark_case(make_case(*arguments), repeats, min_time)
+    return {"python" : platform.python_version(),
+            "platform" : platform.platform(),
+            "time" : time.time(),
+            "seed" : seed,
+            "repeats" : repeats,
+            "min_time" : min_time,
+            "results" : results}
+
+def save_benchmarks(benchmarks, path) :
+    """ Write benchmark results to a JSON file. """
+    with open(path, "w") as results_file :
+        json.dump(benchmarks, results_file, indent=2, sort_keys=True)
+
+def load_benchmarks(path) :
+    """ Read benchmark results from a JSON file. """
+    with open(path) as results_file :
+        return json.load(results_file)
+
+def compare_benchmarks(baseline, current, threshold=0.1) :
+    """ Return a list of (key, baseline ops/sec, current ops/sec, change) for every
+    case that got slower by more than threshold, as a fraction of the baseline. """
+    regressions = []
+    for key in sorted(current["results"]) :
+        if key in baseline["results"] :
+            old = baseline["results"][key]["ops_per_sec"]
+            new = current["results"][key]["ops_per_sec"]
+            change = (new - old) / old
+            if change < -threshold :
+                regressions.append((key, old, new, change))
+    return regressions
+
+def print_benchmarks(benchmarks, regressions=()) :
+    """ Print one line per benchmark case, then any regressions. """
+    for key in sorted(benchmarks["results"]) :
+        result = benchmarks["results"][key]
+        print(key.ljust(20) + str(round(result["ops_per_sec"], 1)).rjust(14) +
+              " ops/sec  +/- " + str(round(result["stdev"], 1)))
+    for key, old, new, change in regressions :
+        print("REGRESSION " + key + ": " + str(round(old, 1)) + " -> " +
+              str(round(new, 1)) + " ops/sec (" + str(round(100 * change, 1)) + "%)")
+
+def benchmark_2048(path=None, baseline_path=None, threshold=0.1, **options) :
+    """ Run the benchmarks, print them, save them to path and compare them with
+    the results saved at baseline_path.  options are passed to run_benchmarks.
+    Returns the results and the list of regressions. """
+    benchmarks = run_benchmarks(**options)
+    regressions = []
+    if baseline_path != None :
+        regressions = compare_benchmarks(load_benchmarks(baseline_path), benchmarks, threshold)
+    print_benchmarks(benchmarks, regressions)
+    if path != None :
+        save_benchmarks(benchmarks, path)
+    return benchmarks, regressions
+
+# Start interactive simulation only when run as a script, so importing this
+# module (or a worker process re-importing it) does not open the GUI.
+if __name__ == "__main__" and poc_2048_gui != None :
+    poc_2048_gui.run_gui(TwentyFortyEight(4, 4))
 
@@ -8,15 +8,84 @@ Rohan Lewis
 
 March 2018 """
 
-import poc_fifteen_gui
+import argparse
+import collections
+import contextlib
+import heapq
+import mmap
+import multiprocessing
+import random
+import struct
+import sys
+import time
+
+try :
+    import poc_fifteen_gui
+except ImportError :
+    poc_fifteen_gui = None
+
+# How solve_puzzle checks its invariants: re-walking every solved tile, only
+# the tiles the last step could have moved, or not at all.
+VERIFY_MODES = ("full", "incremental", "none")
+
+# Moves of the zero tile, and the move that undoes each of them.
+INVERSE_MOVES = {"l" : "r", "r" : "l", "u" : "d", "d" : "u"}
+
+def linear_conflict(goal_offsets) :
+    """Extra moves needed by tiles that are in their goal row (or column) but in
+    the wrong order.  goal_offsets lists the goal column (or row) of each such
+    tile, in the order they appear.  Every tile outside the longest increasing
+    subsequence has to leave the line and come back, which costs two moves.
+    Returns an integer."""
+    longest = []
+    for index in range(len(goal_offsets)) :
+        best = 1
+        for previous in range(index) :
+            if goal_offsets[previous] < goal_offsets[index] and longest[previous] + 1 > best :
+                best = longest[previous] + 1
+        longest.append(best)
+    if len(longest) == 0 :
+        return 0
+    return 2 * (len(goal_offsets) - max(longest))
+
+def permutation_parity(values) :
+    """Parity of a permutation of 0 to len(values) - 1, found in linear time by
+    counting its cycles: a cycle of length k is k - 1 transpositions.  Returns 0
+    for even and 1 for odd permutations."""
+    seen = [False] * len(values)
+    transpositions = 0
+    for start in range(len(values)) :
+        if not seen[start] :
+            position = start
+            while not seen[position] :
+                seen[position] = True
+                position = values[position]
+                transpositions += 1
+            transpositions -= 1
+    return transpositions % 2
+
+def is_solvable_numbers(height, width, values) :
+    """Check whether the numbers values, row by row, can be slid into the solved
+    configuration.  Every move swaps the zero tile with a neighbor, changing both
+    the parity of the permutation and the parity of the zero tile's distance from
+    the upper left corner, so these must agree.  On boards one row or column wide
+    the other tiles can never pass each other.  Returns a boolean."""
+    if height == 1 or width == 1 :
+        tiles = [value for value in values if value != 0]
+        return tiles == sorted(tiles)
+    zero_row, zero_col = divmod(values.index(0), width)
+    return permutation_parity(values) == (zero_row + zero_col) % 2
 
 class Puzzle:
     """Class representation for the Fifteen puzzle."""
 
-    def __init__(self, puzzle_height, puzzle_width, initial_grid=None) :
-        """Initialize puzzle with default height and width.  Returns a Puzzle object"""
+    def __init__(self, puzzle_height, puzzle_width, initial_grid=None, check_solvable=False) :
+        """Initialize puzzle with default height and width.  If check_solvable is
+        True, unsolvable initial grids are rejected.  Returns a Puzzle object"""
         self._height = puzzle_height
         self._width = puzzle_width
+        self._solver_stats = {}
+        self._optimizer_report = {}
         self._grid = [[col + puzzle_width * row
                        for col in range(self._width)]
                       for row in range(self._height)]
@@ -26,6 +95,15 @@ class Puzzle:
                 for col in range(puzzle_width) :
                     self._grid[row][col] = initial_grid[row][col]
 
+        #Inverse of the grid: current (row, col) of every value.
+        self._positions = {}
+        for row in range(puzzle_height) :
+            for col in range(puzzle_width) :
+                self._positions[self._grid[row][col]] = (row, col)
+
+        if check_solvable :
+            assert self.is_solvable(), "Puzzle is not solvable."
+
     def __str__(self) :
         """Generate string representaion for puzzle.  Returns a string."""
         ans = ""
@@ -52,6 +130,7 @@ class Puzzle:
     def set_number(self, row, col, value) :
         """Setter for the number at tile position pos."""
         self._grid[row][col] = value
+        self._positions[value] = (row, col)
 
     def clone(self) :
         """Make a copy of the puzzle to update during solving.  Returns a Puzzle object."""
@@ -66,38 +145,61 @@ class Puzzle:
         is solved.  Returns a tuple of two integers."""
         solved_value = (solved_col + self._width * solved_row)
 
+        #The index can only be stale after set_number overwrote a tile.
+        position = self._positions.get(solved_value)
+        if position != None and self._grid[position[0]][position[1]] == solved_value :
+            return position
+
         for row in range(self._height) :
             for col in range(self._width) :
                 if self._grid[row][col] == solved_value:
+                    self._positions[solved_value] = (row, col)
                     return (row, col)
         assert False, "Value " + str(solved_value) + " not found"
 
     def update_puzzle(self, move_string) :
         """Updates the puzzle state based on the provided move string."""
         zero_row, zero_col = self.current_position(0, 0)
+        grid = self._grid
+        positions = self._positions
         for direction in move_string :
             if direction == "l":
                 assert zero_col > 0, "move off grid: " + direction
-                self._grid[zero_row][zero_col] = self._grid[zero_row][zero_col - 1]
-                self._grid[zero_row][zero_col - 1] = 0
+                tile = grid[zero_row][zero_col - 1]
+                grid[zero_row][zero_col] = tile
+                grid[zero_row][zero_col - 1] = 0
+                positions[tile] = (zero_row, zero_col)
                 zero_col -= 1
             elif direction == "r" :
                 assert zero_col < self._width - 1, "move off grid: " + direction
-                self._grid[zero_row][zero_col] = self._grid[zero_row][zero_col + 1]
-                self._grid[zero_row][zero_col + 1] = 0
+                tile = grid[zero_row][zero_col + 1]
+                grid[zero_row][zero_col] = tile
+                grid[zero_row][zero_col + 1] = 0
+                positions[tile] = (zero_row, zero_col)
                 zero_col += 1
             elif direction == "u" :
                 assert zero_row > 0, "move off grid: " + direction
-                self._grid[zero_row][zero_col] = self._grid[zero_row - 1][zero_col]
-                self._grid[zero_row - 1][zero_col] = 0
+                tile = grid[zero_row - 1][zero_col]
+                grid[zero_row][zero_col] = tile
+                grid[zero_row - 1][zero_col] = 0
+                positions[tile] = (zero_row, zero_col)
                 zero_row -= 1
             elif direction == "d" :
                 assert zero_row < self._height - 1, "move off grid: " + direction
-                self._grid[zero_row][zero_col] = self._grid[zero_row + 1][zero_col]
-                self._grid[zero_row + 1][zero_col] = 0
+                tile = grid[zero_row + 1][zero_col]
+                grid[zero_row][zero_col] = tile
+                grid[zero_row + 1][zero_col] = 0
+                positions[tile] = (zero_row, zero_col)
                 zero_row += 1
             else:
                 assert False, "invalid direction: " + direction
+        positions[0] = (zero_row, zero_col)
+
+    def is_solvable(self) :
+        """Check whether the puzzle can reach the solved configuration, from the
+        parity of the tiles and the zero tile in linear time.  Returns a boolean."""
+        values = [value for row in self._grid for value in row]
+        return is_solvable_numbers(self._height, self._width, values)
 
     ##################################################################
     # Phase one methods
@@ -367,8 +469,18 @@ class Puzzle:
     ###########################################################
     # Phase 3 methods
 
-    def solve_2x2(self) :
-        """Solve the upper left 2x2 part of the puzzle.  Updates the puzzle and returns a move string."""
+    def solve_2x2(self, distance_table=None) :
+        """Solve the upper left 2x2 part of the puzzle, from a 2x2 DistanceTable if
+        one is given.  Updates the puzzle and returns a move string."""
+        if distance_table != None :
+            assert (distance_table.get_height(), distance_table.get_width()) == (2, 2), "Distance table is not 2x2."
+            #Number the four tiles as they would be on a 2x2 board.
+            values = [self._grid[row][col] for row in range(2) for col in range(2)]
+            values = [(value // self._width) * 2 + value % self._width for value in values]
+            move_string = distance_table.solution(values)
+            self.update_puzzle(move_string)
+            return move_string
+
         zero_location = self.current_position(0,0)
         one_location = self.current_position(0,1)
                    
@@ -407,25 +519,92 @@ class Puzzle:
         self.update_puzzle(move_string)
         return move_string  
 
-    def solve_puzzle(self) :
-        """Generate a solution string for a puzzle.  Updates the puzzle and returns a move string."""
-        my_puzzle = self.clone()
+    def solved_region(self, row, col, target_row, target_col) :
+        """Check whether (row, col) is already solved when the tile for
+        (target_row, target_col) is next, in the order solve_puzzle works.
+        Returns a boolean."""
+        if target_row > 1 :
+            return row > target_row or (row == target_row and col > target_col)
+        return row > 1 or col > target_col or (target_row == 0 and row == 1 and col == target_col)
+
+    def prefix_invariant(self, target_row, target_col, step_start, step) :
+        """Incremental form of the invariant for the tile at (target_row,
+        target_col), given that it held for the previous tile before the move
+        string step, which started with the zero tile at step_start.  Only cells
+        the zero tile visited during the step can have changed, so only those in
+        the solved region are checked.  Returns a boolean."""
+        if self._grid[target_row][target_col] != 0 :
+            return False
+        row, col = step_start
+        width = self._width
+        grid = self._grid
+        for direction in "-" + step :
+            if direction == "l" :
+                col -= 1
+            elif direction == "r" :
+                col += 1
+            elif direction == "u" :
+                row -= 1
+            elif direction == "d" :
+                row += 1
+            if self.solved_region(row, col, target_row, target_col) and grid[row][col] != col + width * row :
+                return False
+        return True
+
+    def check_invariant(self, verify, target_row, target_col, step_start, step) :
+        """Assert the invariant for the tile at (target_row, target_col): in full
+        by lower_row_invariant, row1_invariant or row0_invariant if verify is
+        "full", by prefix_invariant if it is "incremental", not at all if it is
+        "none"."""
+        if verify == "full" :
+            if target_row > 1 :
+                holds = self.lower_row_invariant(target_row, target_col)
+            elif target_row == 1 :
+                holds = self.row1_invariant(target_col)
+            else :
+                holds = self.row0_invariant(target_col)
+        elif verify == "incremental" :
+            holds = self.prefix_invariant(target_row, target_col, step_start, step)
+        else :
+            holds = True
+        assert holds, "Problem with invariant (" + str(target_row) + ", " + str(target_col) + ")."
+
+    def solve_puzzle_steps(self, distance_table=None, verify="full", apply=False) :
+        """Generator that yields the moves of the layered solution one tile at a
+        time, so they can be written out as they are found.  A 2x2 DistanceTable,
+        if given, is used for the final phase.  verify is one of VERIFY_MODES:
+        the invariant before each tile is checked in full, incrementally, or
+        skipped; the moves are the same either way.  If apply is True the puzzle
+        itself is solved as the moves are yielded, otherwise a copy is."""
+        assert verify in VERIFY_MODES, "Unknown verify mode: " + str(verify)
+        assert self.is_solvable(), "Puzzle is not solvable."
+        assert distance_table == None or (distance_table.get_height(), distance_table.get_width()) == (2, 2), \
+               "Distance table is not 2x2."
+        if apply :
+            my_puzzle = self
+        else :
+            my_puzzle = self.clone()
         
         target_row = my_puzzle.get_height() - 1
         target_col = my_puzzle.get_width() - 1
-        move_string = ""
     
         #Phase 1.
-        move_string += my_puzzle.zero_corner_initialize()
+        step_start = my_puzzle.current_position(0, 0)
+        step = my_puzzle.zero_corner_initialize()
+        yield step
         while target_row > 1 :
             while target_col > 0 :
-                assert my_puzzle.lower_row_invariant(target_row, target_col), "Problem with invariant (" + str(target_col) + ", " + str(target_col) + ")."
-                move_string += my_puzzle.solve_interior_tile(target_row, target_col)
+                my_puzzle.check_invariant(verify, target_row, target_col, step_start, step)
+                step_start = (target_row, target_col)
+                step = my_puzzle.solve_interior_tile(target_row, target_col)
+                yield step
                 target_col -= 1
             
             if target_col == 0 :
-                assert my_puzzle.lower_row_invariant(target_row, target_col), "Problem with invariant (" + str(target_col) + ", " + str(target_col) + ")."
-                move_string += my_puzzle.solve_col0_tile(target_row)
+                my_puzzle.check_invariant(verify, target_row, target_col, step_start, step)
+                step_start = (target_row, target_col)
+                step = my_puzzle.solve_col0_tile(target_row)
+                yield step
                 target_col = my_puzzle.get_width() - 1
 
             target_row -= 1
@@ -434,16 +613,1040 @@ class Puzzle:
         assert target_row == 1, "Phase 1 not complete."
         assert target_col == my_puzzle.get_width() - 1, "Phase 1 not complete."
         while target_col > 1:
-            assert my_puzzle.row1_invariant(target_col), "Problem with invariant (1, " + str(target_col) + ")."
-            move_string += my_puzzle.solve_row1_tile(target_col)
-            assert my_puzzle.row0_invariant(target_col), "Problem with invariant (0, " + str(target_col) + ")."
-            move_string += my_puzzle.solve_row0_tile(target_col)
+            my_puzzle.check_invariant(verify, 1, target_col, step_start, step)
+            step_start = (1, target_col)
+            step = my_puzzle.solve_row1_tile(target_col)
+            yield step
+            my_puzzle.check_invariant(verify, 0, target_col, step_start, step)
+            step_start = (0, target_col)
+            step = my_puzzle.solve_row0_tile(target_col)
+            yield step
             target_col -=1
             
         #Phase 3.
-        move_string += my_puzzle.solve_2x2()
+        yield my_puzzle.solve_2x2(distance_table)
+
+    def solve_puzzle(self, distance_table=None, verify="full") :
+        """Generate a solution string for a puzzle, solving a copy with
+        solve_puzzle_steps and taking over its grid once it is solved, so a
+        failed check leaves the puzzle as it was.  Updates the puzzle and
+        returns a move string."""
+        my_puzzle = self.clone()
+        move_string = "".join(my_puzzle.solve_puzzle_steps(distance_table, verify, apply=True))
+        self._grid = my_puzzle._grid
+        self._positions = my_puzzle._positions
+        return move_string
+
+    def write_solution(self, output_file, distance_table=None, verify="full", apply=False) :
+        """Write the layered solution to an open file, or anything else with a
+        write method, one tile at a time, so memory does not grow with its
+        length.  Returns the number of moves written."""
+        num_moves = 0
+        for step in self.solve_puzzle_steps(distance_table, verify, apply) :
+            output_file.write(step)
+            num_moves += len(step)
+        return num_moves
+
+    ###########################################################
+    # Move string optimizer
+
+    def optimize_move_string(self, move_string, window=12, max_time=1.0) :
+        """Shorten a valid move string for this puzzle without changing where it
+        ends.  Removes every stretch that comes back to an earlier state (which
+        includes immediate inverses like "lr"), then replaces each window of moves
+        by a shortest path between the same two states, found by breadth first
+        search inside the rectangle the zero tile visits.  Larger windows find more
+        and take longer; passes repeat until nothing improves or max_time seconds
+        have passed.  The puzzle is not changed.  Returns a move string."""
+        start = time.time()
+        moves = list(self.remove_move_cycles(move_string))
+        improved = True
+        while improved and (max_time == None or time.time() - start < max_time) :
+            improved = False
+            state = [self._grid[row][col] for row in range(self._height) for col in range(self._width)]
+            zero = state.index(0)
+            index = 0
+            while index < len(moves) :
+                if max_time != None and time.time() - start >= max_time :
+                    break
+                segment = moves[index:index + window]
+                shorter = self.shortest_path_within(state, zero, segment)
+                if shorter != None :
+                    moves[index:index + len(segment)] = list(shorter)
+                    improved = True
+                    #An empty path at the end leaves no move to apply.
+                    if index >= len(moves) :
+                        break
+                zero = self.apply_flat_move(state, zero, moves[index])
+                index += 1
+            moves = list(self.remove_move_cycles("".join(moves)))
+
+        optimized = "".join(moves)
+        original_end = self.clone()
+        original_end.update_puzzle(move_string)
+        optimized_end = self.clone()
+        optimized_end.update_puzzle(optimized)
+        if str(optimized_end) != str(original_end) or len(optimized) > len(move_string) :
+            optimized = move_string
+        self._optimizer_report = {"original" : len(move_string),
+                                  "optimized" : len(optimized),
+                                  "reduction" : len(move_string) - len(optimized),
+                                  "time" : time.time() - start}
+        return optimized
+
+    def get_optimizer_report(self) :
+        """Getter for the lengths before and after the last optimize_move_string,
+        the reduction and the seconds taken.  Returns a dictionary."""
+        return dict(self._optimizer_report)
+
+    def apply_flat_move(self, state, zero, direction) :
+        """Apply one move to a flat copy of the grid.  Returns the new position of
+        the zero tile."""
+        if direction == "l" :
+            position = zero - 1
+        elif direction == "r" :
+            position = zero + 1
+        elif direction == "u" :
+            position = zero - self._width
+        else :
+            position = zero + self._width
+        state[zero] = state[position]
+        state[position] = 0
+        return position
+
+    def remove_move_cycles(self, move_string) :
+        """Remove every stretch of a move string that returns the puzzle to a state
+        it was in before.  States are recognized by an incrementally updated
+        Zobrist hash.  Returns a move string."""
+        size = self._height * self._width
+        keys = random.Random(size)
+        zobrist = [[keys.getrandbits(64) for dummy_cell in range(size)] for dummy_value in range(size)]
+        state = [self._grid[row][col] for row in range(self._height) for col in range(self._width)]
+        zero = state.index(0)
+        state_hash = 0
+        for position in range(size) :
+            state_hash ^= zobrist[state[position]][position]
+
+        seen = {state_hash : 0}
+        hashes = [state_hash]
+        kept = []
+        for direction in move_string :
+            old_zero = zero
+            zero = self.apply_flat_move(state, zero, direction)
+            tile = state[old_zero]
+            state_hash ^= (zobrist[0][zero] ^ zobrist[0][old_zero] ^
+                           zobrist[tile][zero] ^ zobrist[tile][old_zero])
+            if state_hash in seen :
+                #Back at an earlier state, so drop the moves since then.
+                length = seen[state_hash]
+                for dropped_hash in hashes[length + 1:] :
+                    del seen[dropped_hash]
+                del kept[length:]
+                del hashes[length + 1:]
+            else :
+                kept.append(direction)
+                hashes.append(state_hash)
+                seen[state_hash] = len(kept)
+        return "".join(kept)
+
+    def shortest_path_within(self, state, zero, segment) :
+        """Search for a path shorter than segment between the state and the state
+        segment leads to, moving the zero tile only inside the rectangle segment
+        visits (plus a border of one).  Uses bidirectional breadth first search.
+        Returns a move string, or None if there is no shorter path."""
+        if len(segment) < 2 :
+            return None
+        rows = [zero // self._width]
+        cols = [zero % self._width]
+        for direction in segment :
+            if direction == "l" :
+                cols.append(cols[-1] - 1)
+                rows.append(rows[-1])
+            elif direction == "r" :
+                cols.append(cols[-1] + 1)
+                rows.append(rows[-1])
+            elif direction == "u" :
+                rows.append(rows[-1] - 1)
+                cols.append(cols[-1])
+            else :
+                rows.append(rows[-1] + 1)
+                cols.append(cols[-1])
+        top = max(min(rows) - 1, 0)
+        bottom = min(max(rows) + 1, self._height - 1)
+        left = max(min(cols) - 1, 0)
+        right = min(max(cols) + 1, self._width - 1)
+        local_width = right - left + 1
+        cells = [row * self._width + col for row in range(top, bottom + 1)
+                 for col in range(left, right + 1)]
+        begin = tuple([state[cell] for cell in cells])
+        local = list(begin)
+        local_zero = (rows[0] - top) * local_width + cols[0] - left
+        for direction in segment :
+            local_zero = self.apply_local_move(local, local_zero, direction, local_width)
+        end = tuple(local)
+        if begin == end :
+            return ""
+
+        #Meet in the middle, expanding the smaller frontier, with at most
+        #len(segment) - 1 moves in total.
+        local_height = bottom - top + 1
+        forward = {begin : ""}
+        backward = {end : ""}
+        forward_frontier = [begin]
+        backward_frontier = [end]
+        depth = 0
+        while depth < len(segment) - 1 and forward_frontier and backward_frontier :
+            depth += 1
+            expand_forward = len(forward_frontier) <= len(backward_frontier)
+            if expand_forward :
+                frontier, paths, others = forward_frontier, forward, backward
+            else :
+                frontier, paths, others = backward_frontier, backward, forward
+            next_frontier = []
+            for local_state in frontier :
+                path = paths[local_state]
+                position = local_state.index(0)
+                row, col = divmod(position, local_width)
+                for direction in "lrud" :
+                    if ((direction == "l" and col == 0) or (direction == "r" and col == local_width - 1) or
+                        (direction == "u" and row == 0) or (direction == "d" and row == local_height - 1)) :
+                        continue
+                    if path and direction == INVERSE_MOVES[path[-1]] :
+                        continue
+                    moved = list(local_state)
+                    self.apply_local_move(moved, position, direction, local_width)
+                    moved = tuple(moved)
+                    if moved in paths :
+                        continue
+                    paths[moved] = path + direction
+                    if moved in others :
+                        if expand_forward :
+                            forward_path, backward_path = paths[moved], others[moved]
+                        else :
+                            forward_path, backward_path = others[moved], paths[moved]
+                        return forward_path + "".join([INVERSE_MOVES[move] for move in reversed(backward_path)])
+                    next_frontier.append(moved)
+            if expand_forward :
+                forward_frontier = next_frontier
+            else :
+                backward_frontier = next_frontier
+        return None
+
+    def apply_local_move(self, local, local_zero, direction, local_width) :
+        """Apply one move to a flat rectangle of the grid with the given width.
+        Returns the new position of the zero tile."""
+        if direction == "l" :
+            position = local_zero - 1
+        elif direction == "r" :
+            position = local_zero + 1
+        elif direction == "u" :
+            position = local_zero - local_width
+        else :
+            position = local_zero + local_width
+        local[local_zero] = local[position]
+        local[position] = 0
+        return position
+
+    ###########################################################
+    # Optimal solver
+
+    def get_solver_stats(self) :
+        """Getter for the statistics of the last search: nodes expanded, seconds,
+        nodes per second and solution length.  Returns a dictionary."""
+        return dict(self._solver_stats)
+
+    def solve_optimal(self, max_nodes=None, pattern_databases=None) :
+        """Generate a shortest solution string by IDA* with the Manhattan distance
+        plus linear conflict heuristic.  Works on a flat copy of the grid, making
+        and unmaking moves in place and updating the heuristic for the two lines
+        each move touches.  If a list of PatternDatabase objects for disjoint
+        patterns is given, the larger of their sum and the Manhattan plus linear
+        conflict estimate is used.  Updates the puzzle and returns a move string, or
+        returns None without changing the puzzle if more than max_nodes are
+        expanded."""
+        assert self.is_solvable(), "Puzzle is not solvable."
+        height = self._height
+        width = self._width
+        size = height * width
+        state = [self._grid[row][col] for row in range(height) for col in range(width)]
+
+        #For each position of the zero tile, its moves as (new position, move).
+        neighbors = []
+        for position in range(size) :
+            row, col = divmod(position, width)
+            position_moves = []
+            if col > 0 :
+                position_moves.append((position - 1, "l"))
+            if col < width - 1 :
+                position_moves.append((position + 1, "r"))
+            if row > 0 :
+                position_moves.append((position - width, "u"))
+            if row < height - 1 :
+                position_moves.append((position + width, "d"))
+            neighbors.append(position_moves)
+
+        #Manhattan distance of every tile from every position.
+        distance = [[abs(value // width - position // width) + abs(value % width - position % width)
+                     for position in range(size)] for value in range(size)]
+        distance[0] = [0] * size
+
+        row_cache = {}
+        col_cache = {}
+
+        def row_conflict(row) :
+            """Linear conflict of a row of state, cached by row and contents."""
+            key = (row, tuple(state[row * width:(row + 1) * width]))
+            if key not in row_cache :
+                row_cache[key] = linear_conflict([value % width for value in key[1]
+                                                  if value != 0 and value // width == row])
+            return row_cache[key]
+
+        def col_conflict(col) :
+            """Linear conflict of a column of state, cached by column and contents."""
+            key = (col, tuple(state[col::width]))
+            if key not in col_cache :
+                col_cache[key] = linear_conflict([value // width for value in key[1]
+                                                  if value != 0 and value % width == col])
+            return col_cache[key]
+
+        row_conflicts = [row_conflict(row) for row in range(height)]
+        col_conflicts = [col_conflict(col) for col in range(width)]
+        manhattan = sum([distance[state[position]][position] for position in range(size)])
+
+        #Cell of every tile, and the pattern database (if any) of every tile.
+        if pattern_databases == None :
+            pattern_databases = []
+        positions = [0] * size
+        for position in range(size) :
+            positions[state[position]] = position
+        tile_database = [None] * size
+        database_values = {}
+        for database in pattern_databases :
+            assert (database.get_height(), database.get_width()) == (height, width), "Pattern database is for another size."
+            for tile in database.get_tiles() :
+                tile_database[tile] = database
+            database_values[database] = database.lookup_positions(positions)
+
+        nodes = [0]
+        path = []
+        found = -1
+
+        def search_bound(cost, bound, skip_move, zero, manhattan, conflicts, patterns) :
+            """Depth first search below the current state, where skip_move would
+            undo the last move.  Returns found, None when out of nodes, or the
+            smallest estimate that went over the bound."""
+            estimate = cost + max(manhattan + conflicts, patterns)
+            if estimate > bound :
+                return estimate
+            if manhattan == 0 :
+                return found
+            nodes[0] += 1
+            if max_nodes != None and nodes[0] > max_nodes :
+                return None
+            minimum = float("inf")
+            for position, move in neighbors[zero] :
+                if move == skip_move :
+                    continue
+                #Make the move and update the two lines it changes.
+                tile = state[position]
+                state[zero] = tile
+                state[position] = 0
+                if move == "l" or move == "r" :
+                    conflicts_list = col_conflicts
+                    line_conflict_of = col_conflict
+                    first = zero % width
+                    second = position % width
+                else :
+                    conflicts_list = row_conflicts
+                    line_conflict_of = row_conflict
+                    first = zero // width
+                    second = position // width
+                old_first = conflicts_list[first]
+                old_second = conflicts_list[second]
+                conflicts_list[first] = line_conflict_of(first)
+                conflicts_list[second] = line_conflict_of(second)
+                positions[tile] = zero
+                database = tile_database[tile]
+                new_patterns = patterns
+                if database != None :
+                    old_value = database_values[database]
+                    database_values[database] = database.lookup_positions(positions)
+                    new_patterns += database_values[database] - old_value
+                path.append(move)
+
+                result = search_bound(cost + 1, bound, INVERSE_MOVES[move], position,
+                                      manhattan + distance[tile][zero] - distance[tile][position],
+                                      conflicts + conflicts_list[first] + conflicts_list[second] -
+                                      old_first - old_second, new_patterns)
+                if result == found or result == None :
+                    return result
+                if result < minimum :
+                    minimum = result
+
+                #Unmake the move.
+                path.pop()
+                state[position] = tile
+                state[zero] = 0
+                conflicts_list[first] = old_first
+                conflicts_list[second] = old_second
+                positions[tile] = position
+                if database != None :
+                    database_values[database] = old_value
+            return minimum
+
+        start = time.time()
+        zero = state.index(0)
+        conflicts = sum(row_conflicts) + sum(col_conflicts)
+        patterns = sum(database_values.values())
+        bound = max(manhattan + conflicts, patterns)
+        while True :
+            result = search_bound(0, bound, None, zero, manhattan, conflicts, patterns)
+            if result == found or result == None :
+                break
+            bound = result
+
+        elapsed = time.time() - start
+        self._solver_stats = {"nodes" : nodes[0],
+                              "time" : elapsed,
+                              "nodes_per_sec" : nodes[0] / elapsed if elapsed > 0 else 0.0,
+                              "length" : len(path) if result == found else None}
+        if result == None :
+            return None
+        move_string = "".join(path)
+        self.update_puzzle(move_string)
+        return move_string
+
+    def solve_exact(self, distance_table) :
+        """Generate a shortest solution string from a DistanceTable of this board
+        size, one table read per move.  Updates the puzzle and returns a move
+        string."""
+        assert (distance_table.get_height(), distance_table.get_width()) == (self._height, self._width), \
+               "Distance table is for another board size."
+        move_string = distance_table.solution([value for row in self._grid for value in row])
+        self.update_puzzle(move_string)
+        return move_string
+
+    ###########################################################
+    # Anytime solver
+
+    def anytime_solutions(self, max_time=1.0, max_nodes=None, weights=(5.0, 3.0, 2.0, 1.5, 1.25, 1.0)) :
+        """Generator that yields ever shorter solution strings: first the one from
+        solve_puzzle, then whatever weighted A* finds with each of the decreasing
+        weights on the Manhattan distance, until max_time seconds or max_nodes
+        expansions are used up.  States are packed into integers, and the closed
+        set keeps only the cost and last move of each, from which paths are
+        rebuilt.  Nodes that cannot beat the best solution so far are pruned.  The
+        puzzle is not changed."""
+        start = time.time()
+        best = self.clone().solve_puzzle()
+        self._solver_stats = {"nodes" : 0, "seconds" : 0.0, "length" : len(best),
+                              "weight" : None, "optimal" : len(best) == 0}
+        yield best
+        if len(best) == 0 :
+            return
+
+        height = self._height
+        width = self._width
+        size = height * width
+        bits = max(1, (size - 1).bit_length())
+        mask = (1 << bits) - 1
+        state = 0
+        goal = 0
+        heuristic = 0
+        for row in range(height) :
+            for col in range(width) :
+                value = self._grid[row][col]
+                state |= value << (bits * (row * width + col))
+                goal |= (row * width + col) << (bits * (row * width + col))
+                if value != 0 :
+                    heuristic += abs(value // width - row) + abs(value % width - col)
+        zero_row, zero_col = self.current_position(0, 0)
+
+        #Manhattan distance of every tile at every position.
+        manhattan = [[abs(value // width - position // width) + abs(value % width - position % width)
+                      for position in range(size)] for value in range(size)]
+        #For each position of the zero tile, its moves as (new position, move code).
+        neighbors = []
+        for position in range(size) :
+            row, col = divmod(position, width)
+            position_moves = []
+            if col > 0 :
+                position_moves.append((position - 1, 0))
+            if row > 0 :
+                position_moves.append((position - width, 1))
+            if col < width - 1 :
+                position_moves.append((position + 1, 2))
+            if row < height - 1 :
+                position_moves.append((position + width, 3))
+            neighbors.append(position_moves)
+        codes = "lurd"
+        steps = [-1, -width, 1, width]
+        nodes = 0
+
+        for weight in weights :
+            if time.time() - start >= max_time or (max_nodes != None and nodes >= max_nodes) :
+                break
+            #Closed set: packed state to cost * 8 + code of the move into it (4 for the start).
+            closed = {state : 4}
+            frontier = [(weight * heuristic, 0, state, zero_row * width + zero_col, heuristic)]
+            found = None
+            exhausted = True
+            while len(frontier) > 0 :
+                dummy_priority, cost, current, zero, estimate = heapq.heappop(frontier)
+                if closed[current] >> 3 < cost :
+                    continue
+                if current == goal :
+                    found = current
+                    break
+                nodes += 1
+                if nodes & 1023 == 0 and time.time() - start >= max_time :
+                    exhausted = False
+                    break
+                if max_nodes != None and nodes >= max_nodes :
+                    exhausted = False
+                    break
+                for position, code in neighbors[zero] :
+                    tile = (current >> (bits * position)) & mask
+                    next_estimate = estimate - manhattan[tile][position] + manhattan[tile][zero]
+                    if cost + 1 + next_estimate >= len(best) :
+                        continue
+                    child = current ^ (tile << (bits * position)) ^ (tile << (bits * zero))
+                    previous = closed.get(child)
+                    if previous == None or previous >> 3 > cost + 1 :
+                        closed[child] = (cost + 1) << 3 | code
+                        heapq.heappush(frontier, (cost + 1 + weight * next_estimate, cost + 1,
+                                                  child, position, next_estimate))
+
+            if found != None :
+                #Walk back from the goal, undoing the recorded moves.
+                moves = []
+                current = found
+                zero = 0
+                code = closed[current] & 7
+                while code != 4 :
+                    moves.append(codes[code])
+                    position = zero - steps[code]
+                    tile = (current >> (bits * position)) & mask
+                    current = current ^ (tile << (bits * position)) ^ (tile << (bits * zero))
+                    zero = position
+                    code = closed[current] & 7
+                best = "".join(reversed(moves))
+                self._solver_stats = {"nodes" : nodes, "seconds" : time.time() - start,
+                                      "length" : len(best), "weight" : weight, "optimal" : weight == 1.0}
+                yield best
+            elif exhausted and weight == 1.0 :
+                #Nothing shorter exists, the best solution is optimal.
+                self._solver_stats["optimal"] = True
+            self._solver_stats["nodes"] = nodes
+            self._solver_stats["seconds"] = time.time() - start
+
+    def solve_anytime(self, max_time=1.0, max_nodes=None, weights=(5.0, 3.0, 2.0, 1.5, 1.25, 1.0)) :
+        """Generate the shortest solution string anytime_solutions finds within
+        the budget, never longer than the one from solve_puzzle.  Updates the
+        puzzle and returns a move string."""
+        move_string = None
+        for move_string in self.anytime_solutions(max_time, max_nodes, weights) :
+            pass
         self.update_puzzle(move_string)
         return move_string
 
-# Start interactive simulation
-poc_fifteen_gui.FifteenGUI(Puzzle(4, 4))
+###########################################################
+# Pattern databases
+
+# Default partitions of the tiles into disjoint patterns, by board size.
+DEFAULT_PARTITIONS = {(3, 3) : [(1, 2, 3, 4), (5, 6, 7, 8)],
+                      (4, 4) : [(1, 2, 3, 4, 5), (6, 7, 8, 9, 10), (11, 12, 13, 14, 15)]}
+
+# Pattern database files start with a header: magic, height, width and the
+# number of tiles, then the tiles, then one byte per placement of the tiles.
+PATTERN_MAGIC = b"PDB1"
+PATTERN_HEADER = struct.Struct("<4sBBB")
+
+def num_placements(num_cells, num_tiles) :
+    """Number of ways to place num_tiles distinct tiles on num_cells cells.
+    Returns an integer."""
+    count = 1
+    for index in range(num_tiles) :
+        count *= num_cells - index
+    return count
+
+def rank_placement(cells, num_cells) :
+    """Rank a placement of distinct tiles, given as the list of their cells, in
+    0 .. num_placements - 1.  Each cell is numbered among the cells not taken by
+    the tiles before it.  Returns an integer."""
+    rank = 0
+    for index in range(len(cells)) :
+        smaller = cells[index]
+        for previous in range(index) :
+            if cells[previous] < cells[index] :
+                smaller -= 1
+        rank = rank * (num_cells - index) + smaller
+    return rank
+
+def build_pattern_database(height, width, tiles, path, report_every=1000000) :
+    """Build the pattern database for the given tiles by breadth first search
+    backwards from the solved puzzle (zero tile in the upper left).  Only moves of
+    the pattern's tiles are counted, so databases of disjoint patterns can be
+    added.  Writes the table to path and prints progress every report_every
+    states.  Returns the number of states searched."""
+    num_cells = height * width
+    tiles = tuple(tiles)
+    table_size = num_placements(num_cells, len(tiles))
+    table = bytearray([255]) * table_size
+    #One flag per placement and zero tile cell.
+    visited = bytearray(table_size * num_cells)
+    neighbors = []
+    for cell in range(num_cells) :
+        row, col = divmod(cell, width)
+        cell_neighbors = []
+        if col > 0 :
+            cell_neighbors.append(cell - 1)
+        if col < width - 1 :
+            cell_neighbors.append(cell + 1)
+        if row > 0 :
+            cell_neighbors.append(cell - width)
+        if row < height - 1 :
+            cell_neighbors.append(cell + width)
+        neighbors.append(cell_neighbors)
+
+    #Zero-one breadth first search: zero tile moves that do not move a pattern
+    #tile are free and go to the front of the queue.
+    start = time.time()
+    queue = collections.deque([(tiles, 0, 0)])
+    searched = 0
+    while len(queue) > 0 :
+        cells, zero, cost = queue.popleft()
+        rank = rank_placement(cells, num_cells)
+        if visited[rank * num_cells + zero] :
+            continue
+        visited[rank * num_cells + zero] = 1
+        if table[rank] == 255 :
+            table[rank] = cost
+        searched += 1
+        if report_every > 0 and searched % report_every == 0 :
+            print("Pattern " + str(tiles) + ": " + str(searched) + " of " +
+                  str(table_size * (num_cells - len(tiles))) + " states, depth " +
+                  str(cost) + ", " + str(round(time.time() - start, 1)) + " seconds")
+        for neighbor in neighbors[zero] :
+            if neighbor in cells :
+                moved = list(cells)
+                moved[cells.index(neighbor)] = zero
+                moved = tuple(moved)
+                if not visited[rank_placement(moved, num_cells) * num_cells + neighbor] :
+                    queue.append((moved, neighbor, cost + 1))
+            elif not visited[rank * num_cells + neighbor] :
+                queue.appendleft((cells, neighbor, cost))
+
+    with open(path, "wb") as database_file :
+        database_file.write(PATTERN_HEADER.pack(PATTERN_MAGIC, height, width, len(tiles)))
+        database_file.write(bytearray(tiles))
+        database_file.write(table)
+    return searched
+
+def build_pattern_databases(height, width, prefix, partition=None, report_every=1000000) :
+    """Build one pattern database per pattern of a partition of the tiles (the
+    default partition for the board size if None), in files named after prefix
+    and the tiles.  Returns the list of paths."""
+    if partition == None :
+        partition = DEFAULT_PARTITIONS[(height, width)]
+    paths = []
+    for tiles in partition :
+        path = prefix + "-" + str(height) + "x" + str(width) + "-" + "-".join([str(tile) for tile in tiles]) + ".pdb"
+        build_pattern_database(height, width, tiles, path, report_every)
+        paths.append(path)
+    return paths
+
+class PatternDatabase :
+    """Class for a pattern database file, memory-mapped read only so that every
+    process using it shares one copy."""
+
+    def __init__(self, path) :
+        with open(path, "rb") as database_file :
+            self._map = mmap.mmap(database_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self._height, self._width, num_tiles = PATTERN_HEADER.unpack_from(self._map, 0)
+        assert magic == PATTERN_MAGIC, "Not a pattern database: " + path
+        self._tiles = tuple(bytearray(self._map[PATTERN_HEADER.size:PATTERN_HEADER.size + num_tiles]))
+        self._offset = PATTERN_HEADER.size + num_tiles
+        self._num_cells = self._height * self._width
+
+    def get_height(self) :
+        """Getter for the board height.  Returns an integer."""
+        return self._height
+
+    def get_width(self) :
+        """Getter for the board width.  Returns an integer."""
+        return self._width
+
+    def get_tiles(self) :
+        """Getter for the tiles of the pattern.  Returns a tuple."""
+        return self._tiles
+
+    def lookup_positions(self, positions) :
+        """Lower bound on the moves of the pattern's tiles needed to solve the
+        puzzle, where positions[tile] is the cell of each tile.  Returns an
+        integer."""
+        return self._map[self._offset + rank_placement([positions[tile] for tile in self._tiles],
+                                                      self._num_cells)]
+
+    def lookup(self, puzzle) :
+        """Lower bound for a Puzzle.  Returns an integer."""
+        positions = [0] * self._num_cells
+        for row in range(self._height) :
+            for col in range(self._width) :
+                positions[puzzle.get_number(row, col)] = row * self._width + col
+        return self.lookup_positions(positions)
+
+    def close(self) :
+        """Release the memory map."""
+        self._map.close()
+
+###########################################################
+# Exact distance tables
+
+# Boards of at most nine cells have few enough states to store the distance to
+# the solved configuration of every one.  Each state gets one byte: the distance
+# in the low six bits and the first move of a shortest solution in the top two.
+# Distance table files start with a header: magic, height and width.
+DISTANCE_MAGIC = b"DST1"
+DISTANCE_HEADER = struct.Struct("<4sBB")
+DISTANCE_MOVES = "lurd"
+MAX_TABLE_CELLS = 9
+
+def rank_solvable(values) :
+    """Rank a solvable configuration, the numbers row by row, among the
+    num_cells! / 2 solvable ones.  The rank is the zero tile's position followed
+    by the lexicographic rank of the other tiles, whose last digit only tells the
+    solvable configuration from its unsolvable twin with the last two tiles
+    swapped, so it is dropped.  Returns an integer."""
+    tiles = [value for value in values if value != 0]
+    num_tiles = len(tiles)
+    rank = 0
+    weight = 1
+    for index in range(num_tiles - 3, -1, -1) :
+        tile = tiles[index]
+        smaller = 0
+        for later in tiles[index + 1:] :
+            if later < tile :
+                smaller += 1
+        rank += smaller * weight
+        weight *= num_tiles - index
+    return values.index(0) * weight + rank
+
+def build_distance_table(height, width, path=None) :
+    """Breadth first search back from the solved configuration over every
+    solvable configuration of a height by width board.  Writes the table to path,
+    if given.  Returns the table as a bytearray."""
+    num_cells = height * width
+    assert height > 1 and width > 1 and num_cells <= MAX_TABLE_CELLS, "No distance table for this size."
+    num_states = num_placements(num_cells, num_cells) // 2
+    table = bytearray(b"\xff" * num_states)
+
+    #For each position of the zero tile, its moves as (new position, move back).
+    neighbors = []
+    for position in range(num_cells) :
+        row, col = divmod(position, width)
+        position_moves = []
+        if col > 0 :
+            position_moves.append((position - 1, DISTANCE_MOVES.index("r")))
+        if row > 0 :
+            position_moves.append((position - width, DISTANCE_MOVES.index("d")))
+        if col < width - 1 :
+            position_moves.append((position + 1, DISTANCE_MOVES.index("l")))
+        if row < height - 1 :
+            position_moves.append((position + width, DISTANCE_MOVES.index("u")))
+        neighbors.append(position_moves)
+
+    solved = list(range(num_cells))
+    table[rank_solvable(solved)] = 0
+    boundary = collections.deque([(solved, 0)])
+    while len(boundary) > 0 :
+        values, zero = boundary.popleft()
+        distance = table[rank_solvable(values)] & 63
+        for position, move_back in neighbors[zero] :
+            next_values = list(values)
+            next_values[zero] = next_values[position]
+            next_values[position] = 0
+            rank = rank_solvable(next_values)
+            if table[rank] == 255 :
+                table[rank] = (distance + 1) | move_back << 6
+                boundary.append((next_values, position))
+
+    if path != None :
+        with open(path, "wb") as table_file :
+            table_file.write(DISTANCE_HEADER.pack(DISTANCE_MAGIC, height, width))
+            table_file.write(table)
+    return table
+
+class DistanceTable :
+    """Class for an exact distance table, either memory-mapped from a file
+    written by build_distance_table or built in memory."""
+
+    def __init__(self, path=None, height=None, width=None) :
+        if path != None :
+            with open(path, "rb") as table_file :
+                self._map = mmap.mmap(table_file.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, self._height, self._width = DISTANCE_HEADER.unpack_from(self._map, 0)
+            assert magic == DISTANCE_MAGIC, "Not a distance table: " + path
+            self._offset = DISTANCE_HEADER.size
+        else :
+            self._map = None
+            self._height = height
+            self._width = width
+            self._offset = 0
+        self._table = self._map if self._map != None else build_distance_table(height, width)
+
+    def get_height(self) :
+        """Getter for the board height.  Returns an integer."""
+        return self._height
+
+    def get_width(self) :
+        """Getter for the board width.  Returns an integer."""
+        return self._width
+
+    def distance(self, values) :
+        """Number of moves in a shortest solution of the numbers values, row by
+        row.  Returns an integer."""
+        assert is_solvable_numbers(self._height, self._width, values), "Puzzle is not solvable."
+        return self._table[self._offset + rank_solvable(values)] & 63
+
+    def solution(self, values) :
+        """Shortest solution of the numbers values, row by row, following the
+        stored first moves.  Returns a move string."""
+        assert is_solvable_numbers(self._height, self._width, values), "Puzzle is not solvable."
+        values = list(values)
+        zero = values.index(0)
+        steps = {"l" : -1, "u" : -self._width, "r" : 1, "d" : self._width}
+        moves = []
+        entry = self._table[self._offset + rank_solvable(values)]
+        while entry & 63 > 0 :
+            move = DISTANCE_MOVES[entry >> 6]
+            position = zero + steps[move]
+            values[zero] = values[position]
+            values[position] = 0
+            zero = position
+            moves.append(move)
+            entry = self._table[self._offset + rank_solvable(values)]
+        return "".join(moves)
+
+    def close(self) :
+        """Release the memory map, if any."""
+        if self._map != None :
+            self._map.close()
+
+###########################################################
+# Random instances
+
+def random_solvable_numbers(height, width, rng=random) :
+    """Draw the numbers of a puzzle, row by row, uniformly at random among all
+    solvable configurations.  A shuffle is uniform over all configurations, and
+    swapping the last two tiles other than zero of an unsolvable one is a
+    bijection onto the solvable ones, so nothing is rejected.  Returns a list."""
+    values = list(range(height * width))
+    if height == 1 or width == 1 :
+        #The tiles stay in order, only the zero tile can be anywhere.
+        values.pop(0)
+        values.insert(rng.randrange(height * width), 0)
+        return values
+    rng.shuffle(values)
+    zero_row, zero_col = divmod(values.index(0), width)
+    if permutation_parity(values) != (zero_row + zero_col) % 2 :
+        first, second = len(values) - 1, len(values) - 2
+        if values[first] == 0 :
+            first = len(values) - 3
+        elif values[second] == 0 :
+            second = len(values) - 3
+        values[first], values[second] = values[second], values[first]
+    return values
+
+def random_solvable_puzzle(height, width, rng=random) :
+    """Draw a puzzle uniformly at random among all solvable configurations.
+    Returns a Puzzle."""
+    values = random_solvable_numbers(height, width, rng)
+    grid = [values[row * width:(row + 1) * width] for row in range(height)]
+    return Puzzle(height, width, grid)
+
+def write_random_puzzles(path, count, height, width, seed=None) :
+    """Write count uniformly random solvable puzzles to a puzzle file, for
+    benchmarking solve_puzzle_file.  Returns the number of seconds taken."""
+    start = time.time()
+    rng = random.Random(seed)
+    prefix = str(height) + " " + str(width) + " "
+    with open(path, "w") as puzzle_file :
+        for dummy_puzzle in range(count) :
+            values = random_solvable_numbers(height, width, rng)
+            puzzle_file.write(prefix + " ".join([str(value) for value in values]) + "\n")
+    return time.time() - start
+
+###########################################################
+# Benchmarks
+
+def benchmark_verification(sizes=(10, 20, 40, 80), seed=0) :
+    """Time solve_puzzle in each of VERIFY_MODES on one random solvable square
+    puzzle per size, checking that all modes give the same moves.  Returns a
+    dictionary keyed by "HxW" of dictionaries of seconds by mode."""
+    rng = random.Random(seed)
+    results = {}
+    for size in sizes :
+        puzzle = random_solvable_puzzle(size, size, rng)
+        seconds = {}
+        move_strings = set()
+        for verify in VERIFY_MODES :
+            start = time.time()
+            move_strings.add(puzzle.clone().solve_puzzle(verify=verify))
+            seconds[verify] = time.time() - start
+        assert len(move_strings) == 1, "Verify modes disagree on " + str(size) + "x" + str(size) + "."
+        results[str(size) + "x" + str(size)] = seconds
+    return results
+
+###########################################################
+# Batch solving
+
+# Puzzle files have one puzzle per line: the height, the width and then the
+# numbers row by row, separated by spaces or commas.  Blank lines and lines
+# starting with "#" are skipped.  Solution files have one tab separated line per
+# puzzle, in input order: line number, solution length, seconds and the move
+# string, or -1 and "error: ..." if the puzzle could not be solved.
+SOLVERS = ("layered", "optimal", "anytime")
+
+def parse_puzzle_line(line) :
+    """Parse one line of a puzzle file.  Returns a Puzzle, or None for blank and
+    comment lines."""
+    line = line.strip()
+    if line == "" or line.startswith("#") :
+        return None
+    numbers = [int(number) for number in line.replace(",", " ").split()]
+    height, width = numbers[0], numbers[1]
+    assert len(numbers) == 2 + height * width, "Expected " + str(height * width) + " numbers."
+    grid = [numbers[2 + row * width:2 + (row + 1) * width] for row in range(height)]
+    assert sorted(numbers[2:]) == list(range(height * width)), "Numbers must be 0 to " + str(height * width - 1) + "."
+    return Puzzle(height, width, grid)
+
+def format_puzzle_line(puzzle) :
+    """Format a Puzzle as a line of a puzzle file.  Returns a string."""
+    numbers = [puzzle.get_height(), puzzle.get_width()]
+    for row in range(puzzle.get_height()) :
+        for col in range(puzzle.get_width()) :
+            numbers.append(puzzle.get_number(row, col))
+    return " ".join([str(number) for number in numbers])
+
+#Pattern databases opened by this process, by path.
+OPEN_PATTERN_DATABASES = {}
+
+def solve_puzzle_line(task) :
+    """Solve one line of a puzzle file.  task is a tuple (line number, line,
+    solver, max_nodes, pattern database paths).  Returns a tuple (line number,
+    solution length, seconds, move string), or None for lines without a
+    puzzle."""
+    line_number, line, solver, max_nodes, database_paths = task
+    start = time.time()
+    try :
+        puzzle = parse_puzzle_line(line)
+        if puzzle == None :
+            return None
+        if solver == "optimal" :
+            databases = []
+            for path in database_paths or [] :
+                if path not in OPEN_PATTERN_DATABASES :
+                    OPEN_PATTERN_DATABASES[path] = PatternDatabase(path)
+                databases.append(OPEN_PATTERN_DATABASES[path])
+            move_string = puzzle.solve_optimal(max_nodes, databases)
+            assert move_string != None, "node limit reached"
+        elif solver == "anytime" :
+            move_string = puzzle.solve_anytime(max_nodes=max_nodes)
+        else :
+            move_string = puzzle.solve_puzzle()
+    except (AssertionError, ValueError, IndexError) as error :
+        return (line_number, -1, time.time() - start, "error: " + str(error))
+    return (line_number, len(move_string), time.time() - start, move_string)
+
+#ordered_pool_map is copied in Zombie Apocalypse.py, so each game stays a
+#single script; keep the two identical.
+def ordered_pool_map(function, tasks, processes=None, max_pending=None, pending_per_process=16) :
+    """Generator that yields function(task) for every task, in order, as the
+    results are ready.  The tasks run over a pool of processes workers, at most
+    max_pending (pending_per_process per worker by default) at a time, so memory
+    stays bounded for any number of tasks.  processes=1 runs them in this
+    process."""
+    if processes == 1 :
+        for task in tasks :
+            yield function(task)
+        return
+    pool = multiprocessing.Pool(processes)
+    if max_pending == None :
+        max_pending = pending_per_process * (processes or multiprocessing.cpu_count())
+    try :
+        pending = collections.deque()
+        for task in tasks :
+            pending.append(pool.apply_async(function, (task,)))
+            while len(pending) >= max_pending or (len(pending) > 0 and pending[0].ready()) :
+                yield pending.popleft().get()
+        while len(pending) > 0 :
+            yield pending.popleft().get()
+    finally :
+        pool.close()
+        pool.join()
+
+def solve_puzzle_file(input_path, output_path, solver="layered", processes=None,
+                      max_nodes=None, pattern_database_paths=None, max_pending=None) :
+    """Solve every puzzle of a puzzle file with solve_puzzle ("layered"),
+    solve_optimal ("optimal") or solve_anytime ("anytime") over a process pool,
+    and write the solutions in input order as they complete.  At most
+    max_pending puzzles are in flight, so memory stays bounded for any input
+    size.  processes=1 solves in this process.
+    Returns a dictionary of statistics."""
+    assert solver in SOLVERS, "Unknown solver: " + str(solver)
+    stats = {"puzzles" : 0, "solved" : 0, "failed" : 0, "moves" : 0, "solve_time" : 0.0}
+
+    def write_result(result, output_file) :
+        """Write one solution line and count it."""
+        if result == None :
+            return
+        line_number, length, seconds, move_string = result
+        stats["puzzles"] += 1
+        stats["solve_time"] += seconds
+        if length < 0 :
+            stats["failed"] += 1
+        else :
+            stats["solved"] += 1
+            stats["moves"] += length
+        output_file.write(str(line_number) + "\t" + str(length) + "\t" +
+                          str(round(seconds, 6)) + "\t" + move_string + "\n")
+
+    start = time.time()
+    with open(input_path) as input_file, open(output_path, "w") as output_file :
+        tasks = ((line_number, line, solver, max_nodes, pattern_database_paths)
+                 for line_number, line in enumerate(input_file, 1))
+        with contextlib.closing(ordered_pool_map(solve_puzzle_line, tasks, processes, max_pending, 64)) as results :
+            for result in results :
+                write_result(result, output_file)
+
+    stats["elapsed"] = time.time() - start
+    stats["puzzles_per_sec"] = stats["puzzles"] / stats["elapsed"] if stats["elapsed"] > 0 else 0.0
+    return stats
+
+def main(arguments) :
+    """Command line entry point: solve a puzzle file.  Returns an exit code."""
+    parser = argparse.ArgumentParser(description="Solve a file of sliding puzzles, one per line.")
+    parser.add_argument("input", help="puzzle file: height width numbers... per line")
+    parser.add_argument("output", help="solution file, in input order")
+    parser.add_argument("--solver", choices=SOLVERS, default="layered")
+    parser.add_argument("--processes", type=int, default=None)
+    parser.add_argument("--max-nodes", type=int, default=None)
+    parser.add_argument("--pattern-database", action="append", default=None,
+                        help="pattern database file for the optimal solver, may be repeated")
+    options = parser.parse_args(arguments)
+    stats = solve_puzzle_file(options.input, options.output, options.solver, options.processes,
+                              options.max_nodes, options.pattern_database)
+    print(str(stats["puzzles"]) + " puzzles, " + str(stats["solved"]) + " solved, " +
+          str(stats["failed"]) + " failed, " + str(round(stats["puzzles_per_sec"], 1)) +
+          " puzzles/sec")
+    return 0 if stats["failed"] == 0 else 1
+
+# When run as a script, start interactive simulation, or solve a puzzle file
+# if arguments are given.  Importing the module (or a worker process
+# re-importing it) does neither.
+if __name__ == "__main__" :
+    if poc_fifteen_gui != None and len(sys.argv) == 1 :
+        poc_fifteen_gui.FifteenGUI(Puzzle(4, 4))
+    else :
+        sys.exit(main(sys.argv[1:]))
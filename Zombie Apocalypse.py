@@ -6,10 +6,27 @@ Rohan Lewis
 
 March 2018 """
 
+import argparse
+import collections
+import contextlib
+import csv
+import itertools
+import multiprocessing
 import random
+import sys
+import time
 import poc_grid
 import poc_queue
-import poc_zombie_gui
+
+try :
+    import poc_zombie_gui
+except ImportError :
+    poc_zombie_gui = None
+
+try :
+    import numpy as np
+except ImportError :
+    np = None
 
 # global constants
 EMPTY = 0 
@@ -20,6 +37,30 @@ OBSTACLE = 5
 HUMAN = 6
 ZOMBIE = 7
 
+# A kept distance field is recomputed in full rather than repaired once more
+# than this fraction (1 / REPAIR_FRACTION) of its cells would have to change.
+REPAIR_FRACTION = 16
+
+# Row and column steps to the four-way and eight-way neighbors of a cell, in the
+# order four_neighbors and eight_neighbors list them.
+FOUR_STEPS = ((-1, 0), (1, 0), (0, -1), (0, 1))
+EIGHT_STEPS = FOUR_STEPS + ((-1, -1), (-1, 1), (1, -1), (1, 1))
+
+# move_humans and move_zombies move this many entities or more at once with NumPy.
+VECTOR_MIN_ENTITIES = 64
+
+# distance_field computes fields with NumPy on grids of this many cells or more.
+DISTANCE_ARRAY_MIN_CELLS = 1024
+
+def entity_array(entity_list) :
+    """Positions of a list of (row, col) tuples as an (N, 2) integer array."""
+    flat = np.fromiter(itertools.chain.from_iterable(entity_list), dtype=np.int64, count=2 * len(entity_list))
+    return flat.reshape(-1, 2)
+
+def entity_list(positions) :
+    """Positions of an (N, 2) integer array as a list of (row, col) tuples."""
+    return list(zip(positions[:, 0].tolist(), positions[:, 1].tolist()))
+
 class Apocalypse(poc_grid.Grid):
     """Class for simulating zombie pursuit of human on grid with obstacles."""
     
@@ -30,6 +71,9 @@ class Apocalypse(poc_grid.Grid):
         """Create a simulation of given size with given obstacles, humans, and zombies."""
         
         poc_grid.Grid.__init__(self, grid_height, grid_width)
+        self._open_cells = None
+        self._distance_fields = {}
+        self._ticks = 0
         if obstacle_list != None :
             for cell in obstacle_list :
                 self.set_full(cell[0], cell[1])
@@ -49,6 +93,21 @@ class Apocalypse(poc_grid.Grid):
         poc_grid.Grid.clear(self)
         self._zombie_list = []
         self._human_list = []
+        self._open_cells = None
+        self._distance_fields = {}
+        self._ticks = 0
+
+    def set_empty(self, row, col) :
+        """Remove the obstacle at (row, col)."""
+        poc_grid.Grid.set_empty(self, row, col)
+        self._open_cells = None
+        self._distance_fields = {}
+
+    def set_full(self, row, col) :
+        """Place an obstacle at (row, col)."""
+        poc_grid.Grid.set_full(self, row, col)
+        self._open_cells = None
+        self._distance_fields = {}
         
     def add_zombie(self, row, col):
         """Add zombie to the zombie list."""
@@ -78,39 +137,242 @@ class Apocalypse(poc_grid.Grid):
         
     def compute_distance_field(self, entity_type) :
         """Function computes and returns a 2D distance field.  Distance at member of
-        entity_list is zero.  Shortest paths avoid obstacles and use four-way distances."""
-        visited = poc_grid.Grid(self._grid_height, self._grid_width)
+        entity_list is zero.  Shortest paths avoid obstacles and use four-way distances.
+        Cells that cannot be reached, and obstacles, get height * width."""
+        far = self._grid_height * self._grid_width
+        if entity_type == HUMAN :
+            sources = self._human_list
+        elif entity_type == ZOMBIE :
+            sources = self._zombie_list
+        else :
+            sources = []
         
-        distance_field = []
-        for dummy_row in range(self._grid_height) :
-            distance_field.append([])
-            for dummy_col in range(self._grid_width) :
-                distance_field[dummy_row].append(self._grid_height*self._grid_width)
+        #Breadth first search on a flat copy of the grid with a border of obstacles
+        #around it, so neighbors are fixed offsets and need no bounds checks.
+        #Unvisited empty cells are -1, obstacles and the border are -2.
+        padded_width = self._grid_width + 2
+        field = [-2] * padded_width
+        for row in self._cells :
+            field.append(-2)
+            field.extend([-1 if cell == EMPTY else -2 for cell in row])
+            field.append(-2)
+        field.extend([-2] * padded_width)
         
         boundary = []
-        if entity_type == 6 :
-            for dummy_human in self.humans() :
-                boundary.append(dummy_human)
-        if entity_type == 7 :
-            for dummy_zombie in self.zombies() :
-                boundary.append(dummy_zombie)
-                
-        for cell in boundary :
-            visited.set_full(cell[0],cell[1])
-            distance_field[cell[0]][cell[1]] = 0
-            
+        for cell in sources :
+            index = (cell[0] + 1) * padded_width + cell[1] + 1
+            if field[index] != 0 :
+                field[index] = 0
+                boundary.append(index)
+        
+        distance = 0
         while len(boundary) > 0 :
-            current_cell = boundary.pop(0)
-            for neighbor_cell in self.four_neighbors(current_cell[0], current_cell[1]) :
-                if visited.is_empty(neighbor_cell[0], neighbor_cell[1]) and self.is_empty(neighbor_cell[0], neighbor_cell[1]):
-                    visited.set_full(neighbor_cell[0], neighbor_cell[1])
-                    boundary.append(neighbor_cell)
-                    distance_field[neighbor_cell[0]][neighbor_cell[1]] = distance_field[current_cell[0]][current_cell[1]] + 1
+            distance += 1
+            next_boundary = []
+            for index in boundary :
+                neighbor = index - padded_width
+                if field[neighbor] == -1 :
+                    field[neighbor] = distance
+                    next_boundary.append(neighbor)
+                neighbor = index + padded_width
+                if field[neighbor] == -1 :
+                    field[neighbor] = distance
+                    next_boundary.append(neighbor)
+                neighbor = index - 1
+                if field[neighbor] == -1 :
+                    field[neighbor] = distance
+                    next_boundary.append(neighbor)
+                neighbor = index + 1
+                if field[neighbor] == -1 :
+                    field[neighbor] = distance
+                    next_boundary.append(neighbor)
+            boundary = next_boundary
         
+        distance_field = []
+        for row in range(self._grid_height) :
+            start = (row + 1) * padded_width + 1
+            distance_field.append([far if value < 0 else value
+                                   for value in field[start:start + self._grid_width]])
         return distance_field
        
-    def move_humans(self, zombie_distance_field) :
-        """Function that moves humans away from zombies, diagonal moves are allowed."""
+    def distance_field(self, entity_type) :
+        """Distance field for the current humans or zombies, the same as
+        compute_distance_field returns.  The field is kept between calls and
+        repaired in place from the sources that moved since the last one, so it
+        must not be modified.  It is recomputed in full after the obstacles
+        change, or when too many sources moved for a repair to pay, by
+        full_distance_field.  Other entity types are passed on to
+        full_distance_field.  Returns a 2D list."""
+        if entity_type == HUMAN :
+            sources = set(self._human_list)
+        elif entity_type == ZOMBIE :
+            sources = set(self._zombie_list)
+        else :
+            return self.full_distance_field(entity_type)
+        if entity_type not in self._distance_fields :
+            field = self.full_distance_field(entity_type)
+        else :
+            field, old_sources = self._distance_fields[entity_type]
+            removed = old_sources - sources
+            #Each removed source loses about its share of the field.
+            if len(removed) * REPAIR_FRACTION > len(old_sources) :
+                field = self.full_distance_field(entity_type)
+            else :
+                max_lost = self._grid_height * self._grid_width // REPAIR_FRACTION
+                if not self.repair_distance_field(field, removed, sources - old_sources, max_lost) :
+                    field = self.full_distance_field(entity_type)
+        self._distance_fields[entity_type] = (field, sources)
+        return field
+
+    def full_distance_field(self, entity_type) :
+        """Distance field computed from scratch, by compute_distance_array on
+        grids of DISTANCE_ARRAY_MIN_CELLS cells or more when NumPy is there,
+        and by compute_distance_field otherwise.  Returns a 2D list."""
+        if np != None and self._grid_height * self._grid_width >= DISTANCE_ARRAY_MIN_CELLS :
+            return self.compute_distance_array(entity_type).tolist()
+        return self.compute_distance_field(entity_type)
+
+    def repair_distance_field(self, field, removed, added, max_lost=None) :
+        """Update a distance field in place after the sources in removed went away
+        and those in added appeared.  First every cell whose distance relied only
+        on removed sources is found, level by level outward from them: a cell is
+        lost when none of its neighbors one step closer is kept.  Lost cells are
+        cleared, then distances flow back in from the kept cells around them and
+        from the added sources, lowest distance first, lowering any cell they
+        improve.  Only the cells that change, and their neighbors, are visited.
+        Returns False, leaving the field unchanged, if more than max_lost cells
+        are lost, and True otherwise."""
+        height = self._grid_height
+        width = self._grid_width
+        cells = self._cells
+        far = height * width
+
+        #Raise: find the cells left without support.
+        lost = set()
+        boundary = collections.deque()
+        for cell in removed :
+            if field[cell[0]][cell[1]] == 0 :
+                lost.add(cell)
+                boundary.append(cell)
+        while len(boundary) > 0 :
+            row, col = boundary.popleft()
+            level = field[row][col] + 1
+            if level >= far :
+                continue
+            for row_step, col_step in FOUR_STEPS :
+                neighbor_row = row + row_step
+                neighbor_col = col + col_step
+                if (0 <= neighbor_row < height and 0 <= neighbor_col < width and
+                    field[neighbor_row][neighbor_col] == level and cells[neighbor_row][neighbor_col] == EMPTY and
+                    (neighbor_row, neighbor_col) not in lost) :
+                    supported = False
+                    for support_step, support_col_step in FOUR_STEPS :
+                        support_row = neighbor_row + support_step
+                        support_col = neighbor_col + support_col_step
+                        if (0 <= support_row < height and 0 <= support_col < width and
+                            field[support_row][support_col] == level - 1 and
+                            (support_row, support_col) not in lost) :
+                            supported = True
+                            break
+                    if not supported :
+                        lost.add((neighbor_row, neighbor_col))
+                        boundary.append((neighbor_row, neighbor_col))
+            if max_lost != None and len(lost) > max_lost :
+                return False
+
+        #Lower: clear the lost cells and propagate from their kept neighbors and
+        #the added sources, one distance at a time.
+        for row, col in lost :
+            field[row][col] = far
+        levels = {}
+        for row, col in lost :
+            for row_step, col_step in FOUR_STEPS :
+                neighbor_row = row + row_step
+                neighbor_col = col + col_step
+                if 0 <= neighbor_row < height and 0 <= neighbor_col < width :
+                    level = field[neighbor_row][neighbor_col]
+                    if level < far :
+                        levels.setdefault(level, []).append((neighbor_row, neighbor_col))
+        for row, col in added :
+            field[row][col] = 0
+            levels.setdefault(0, []).append((row, col))
+        while len(levels) > 0 :
+            level = min(levels)
+            for row, col in levels.pop(level) :
+                if field[row][col] != level :
+                    continue
+                for row_step, col_step in FOUR_STEPS :
+                    neighbor_row = row + row_step
+                    neighbor_col = col + col_step
+                    if (0 <= neighbor_row < height and 0 <= neighbor_col < width and
+                        field[neighbor_row][neighbor_col] > level + 1 and cells[neighbor_row][neighbor_col] == EMPTY) :
+                        field[neighbor_row][neighbor_col] = level + 1
+                        levels.setdefault(level + 1, []).append((neighbor_row, neighbor_col))
+        return True
+
+    def open_cells(self) :
+        """Boolean NumPy array of the grid with a border of obstacles around it,
+        True for empty cells, flattened row by row.  Kept until the obstacles
+        change.  Returns an array."""
+        if self._open_cells is None :
+            cells = np.zeros((self._grid_height + 2, self._grid_width + 2), dtype=bool)
+            cells[1:-1, 1:-1] = np.array(self._cells, dtype=np.int8) == EMPTY
+            self._open_cells = cells.ravel()
+        return self._open_cells
+
+    def compute_distance_array(self, entity_type) :
+        """NumPy version of compute_distance_field, with the same distances.  All
+        sources expand together one level at a time: the frontier, as flat
+        indices, is dilated by the four neighbor offsets and masked by the cells
+        that are empty and not yet reached.  Only the frontier is touched at each level, so the work
+        is proportional to the number of cells however many levels there are.
+        Returns a 2D integer array."""
+        assert np != None, "compute_distance_array needs NumPy."
+        height = self._grid_height
+        width = self._grid_width
+        padded_width = width + 2
+        if entity_type == HUMAN :
+            sources = self._human_list
+        elif entity_type == ZOMBIE :
+            sources = self._zombie_list
+        else :
+            sources = []
+        
+        #-1 for empty cells not yet reached, -2 for obstacles and the border.
+        field = np.where(self.open_cells(), -1, -2).astype(np.int32)
+        offsets = np.array([-padded_width, padded_width, -1, 1])
+        if len(sources) > 0 :
+            cells = np.array(sources, dtype=np.int64).reshape(-1, 2)
+            boundary = np.unique((cells[:, 0] + 1) * padded_width + cells[:, 1] + 1)
+        else :
+            boundary = np.zeros(0, dtype=np.int64)
+        field[boundary] = 0
+        
+        #A cell next to several frontier cells is kept once: the last candidate
+        #written to owner for it.
+        owner = np.empty(len(field), dtype=np.int64)
+        distance = 0
+        while len(boundary) > 0 :
+            distance += 1
+            neighbors = (boundary[:, None] + offsets).ravel()
+            neighbors = neighbors[field[neighbors] == -1]
+            order = np.arange(len(neighbors))
+            owner[neighbors] = order
+            neighbors = neighbors[owner[neighbors] == order]
+            field[neighbors] = distance
+            boundary = neighbors
+        
+        field = field.reshape(height + 2, padded_width)[1:-1, 1:-1]
+        return np.where(field < 0, height * width, field)
+
+    def move_humans(self, zombie_distance_field, vectorize=True) :
+        """Function that moves humans away from zombies, diagonal moves are allowed.
+        The distance field can be a list of lists or a 2D array.  With vectorize
+        False the loops are used however many humans there are."""
+        if vectorize and np != None and len(self._human_list) >= VECTOR_MIN_ENTITIES :
+            moved = self.move_positions(entity_array(self._human_list), zombie_distance_field, EIGHT_STEPS, False)
+            self._human_list = entity_list(moved)
+            return
         moved_human_list = []    
         for human in self.humans() :
             max_distance = zombie_distance_field[human[0]][human[1]]
@@ -126,8 +388,14 @@ class Apocalypse(poc_grid.Grid):
         for moved_human in moved_human_list :
             self.add_human(moved_human[0], moved_human[1])
                
-    def move_zombies(self, human_distance_field) :
-        """Function that moves zombies towards humans, no diagonal moves are allowed."""
+    def move_zombies(self, human_distance_field, vectorize=True) :
+        """Function that moves zombies towards humans, no diagonal moves are allowed.
+        The distance field can be a list of lists or a 2D array.  With vectorize
+        False the loops are used however many zombies there are."""
+        if vectorize and np != None and len(self._zombie_list) >= VECTOR_MIN_ENTITIES :
+            moved = self.move_positions(entity_array(self._zombie_list), human_distance_field, FOUR_STEPS, True)
+            self._zombie_list = entity_list(moved)
+            return
         moved_zombie_list = []
         for zombie in self.zombies() :
             min_distance = human_distance_field[zombie[0]][zombie[1]]
@@ -142,5 +410,228 @@ class Apocalypse(poc_grid.Grid):
         self._zombie_list = []
         for moved_zombie in moved_zombie_list :
             self.add_zombie(moved_zombie[0], moved_zombie[1])
+
+    def move_positions(self, positions, distance_field, steps, towards) :
+        """NumPy version of move_humans (steps EIGHT_STEPS, towards False) and
+        move_zombies (steps FOUR_STEPS, towards True) for an (N, 2) array of
+        positions.  The field at every empty neighbor is gathered at once, with
+        other neighbors masked out, and each entity moves to the first neighbor,
+        in steps order, with the largest (smallest if towards) value if that is
+        strictly better than its own cell, as the loops do.  Returns the moved
+        (N, 2) array."""
+        field = np.asarray(distance_field, dtype=np.int64).ravel()
+        width = self._grid_width
+        padded_width = width + 2
+        cells = positions[:, 0] * width + positions[:, 1]
+        neighbors = cells[:, None] + np.array([step[0] * width + step[1] for step in steps])
+        #The open cell array has a border of obstacles, so it also masks steps off
+        #the grid, whose flat indices may wrap around.
+        padded_cells = (positions[:, 0] + 1) * padded_width + positions[:, 1] + 1
+        valid = self.open_cells()[padded_cells[:, None] + np.array([step[0] * padded_width + step[1]
+                                                                    for step in steps])]
+        values = field.take(neighbors, mode="wrap")
+        here = field[cells]
+        entities = np.arange(len(positions))
+        if towards :
+            values[~valid] = np.iinfo(np.int64).max
+            best = np.argmin(values, axis=1)
+            better = values[entities, best] < here
+        else :
+            values[~valid] = -1
+            best = np.argmax(values, axis=1)
+            better = values[entities, best] > here
+        moved = np.where(better, neighbors[entities, best], cells)
+        return np.stack(np.divmod(moved, width), axis=1)
+
+    def get_ticks(self) :
+        """Return number of ticks simulated by step."""
+        return self._ticks
+
+    def step(self, catch=True) :
+        """Advance the simulation one tick without the GUI: humans move away from
+        the zombies, then zombies move towards the humans.  If catch is True,
+        humans left on a zombie's cell are caught and removed.  Returns the
+        number of humans caught."""
+        self.move_humans(self.distance_field(ZOMBIE))
+        self.move_zombies(self.distance_field(HUMAN))
+        self._ticks += 1
+        if not catch :
+            return 0
+        zombie_cells = set(self._zombie_list)
+        free_humans = [human for human in self._human_list if human not in zombie_cells]
+        caught = len(self._human_list) - len(free_humans)
+        self._human_list = free_humans
+        return caught
+
+    def run(self, ticks, catch=True) :
+        """Call step up to ticks times, stopping early once every human is caught.
+        Returns a dictionary of statistics: ticks run, humans caught, humans
+        left, the tick on which the last human was caught (or None), seconds and
+        ticks per second."""
+        start = time.time()
+        caught = 0
+        all_caught_tick = None
+        ticks_run = 0
+        while ticks_run < ticks and (len(self._human_list) > 0 or not catch) :
+            caught += self.step(catch)
+            ticks_run += 1
+            if catch and len(self._human_list) == 0 :
+                all_caught_tick = self._ticks
+        seconds = time.time() - start
+        return {"ticks" : ticks_run,
+                "caught" : caught,
+                "humans_left" : len(self._human_list),
+                "all_caught_tick" : all_caught_tick,
+                "seconds" : seconds,
+                "ticks_per_sec" : ticks_run / seconds if seconds > 0 else 0.0}
             
-poc_zombie_gui.run_gui(Apocalypse(30, 40))
\ No newline at end of file
+def random_apocalypse(grid_height, grid_width, obstacle_density=0.2,
+                      num_humans=10, num_zombies=10, rng=random) :
+    """Make a simulation with obstacles on a random obstacle_density fraction of
+    the cells, and humans and zombies on random empty cells.  Returns an
+    Apocalypse."""
+    num_cells = grid_height * grid_width
+    num_obstacles = int(obstacle_density * num_cells)
+    cells = rng.sample(range(num_cells), min(num_cells, num_obstacles + num_humans + num_zombies))
+    obstacles = [divmod(cell, grid_width) for cell in cells[:num_obstacles]]
+    humans = [divmod(cell, grid_width) for cell in cells[num_obstacles:num_obstacles + num_humans]]
+    zombies = [divmod(cell, grid_width) for cell in cells[num_obstacles + num_humans:]]
+    return Apocalypse(grid_height, grid_width, obstacles, zombies, humans)
+
+def benchmark_distance_fields(sizes=(100, 500, 1000, 2000, 4000), obstacle_density=0.2,
+                              num_sources=10, seed=0) :
+    """Time compute_distance_field against compute_distance_array on one random
+    square map per size, checking that the distances agree.  The obstacle array
+    is built first, as it is kept between ticks.  Returns a
+    dictionary keyed by "HxW" of dictionaries of seconds by backend."""
+    rng = random.Random(seed)
+    results = {}
+    for size in sizes :
+        simulation = random_apocalypse(size, size, obstacle_density, 0, num_sources, rng)
+        seconds = {}
+        start = time.time()
+        python_field = simulation.compute_distance_field(ZOMBIE)
+        seconds["python"] = time.time() - start
+        simulation.open_cells()
+        start = time.time()
+        numpy_field = simulation.compute_distance_array(ZOMBIE)
+        seconds["numpy"] = time.time() - start
+        assert numpy_field.tolist() == python_field, "Backends disagree on " + str(size) + "x" + str(size) + "."
+        results[str(size) + "x" + str(size)] = seconds
+    return results
+
+######################################################################
+# Headless scenarios
+
+# Columns of the scenario CSV file, one row per scenario.
+SCENARIO_FIELDS = ("scenario", "seed", "height", "width", "obstacle_density", "humans", "zombies",
+                   "max_ticks", "ticks", "caught", "humans_left", "all_caught_tick", "seconds",
+                   "ticks_per_sec")
+
+def random_scenarios(count, seed=0, sizes=((30, 40), (60, 80), (100, 100)),
+                     obstacle_densities=(0.0, 0.1, 0.2, 0.3),
+                     entity_counts=((1, 1), (10, 5), (50, 20)), max_ticks=500) :
+    """Generator that yields count scenarios, each a dictionary of a seed, a
+    grid size, an obstacle density and numbers of humans and zombies drawn from
+    the given choices, and max_ticks."""
+    rng = random.Random(seed)
+    for scenario in range(count) :
+        height, width = rng.choice(sizes)
+        humans, zombies = rng.choice(entity_counts)
+        yield {"scenario" : scenario,
+               "seed" : rng.randrange(2 ** 32),
+               "height" : height,
+               "width" : width,
+               "obstacle_density" : rng.choice(obstacle_densities),
+               "humans" : humans,
+               "zombies" : zombies,
+               "max_ticks" : max_ticks}
+
+def run_scenario(scenario) :
+    """Build the simulation a scenario describes and run it headless.  Returns
+    the scenario dictionary with the statistics of Apocalypse.run added."""
+    simulation = random_apocalypse(scenario["height"], scenario["width"], scenario["obstacle_density"],
+                                   scenario["humans"], scenario["zombies"], random.Random(scenario["seed"]))
+    result = dict(scenario)
+    result.update(simulation.run(scenario["max_ticks"]))
+    return result
+
+#ordered_pool_map is a copy of the one in Fifteen.py, so each game stays a
+#single script; keep the two identical.
+def ordered_pool_map(function, tasks, processes=None, max_pending=None, pending_per_process=16) :
+    """Generator that yields function(task) for every task, in order, as the
+    results are ready.  The tasks run over a pool of processes workers, at most
+    max_pending (pending_per_process per worker by default) at a time, so memory
+    stays bounded for any number of tasks.  processes=1 runs them in this
+    process."""
+    if processes == 1 :
+        for task in tasks :
+            yield function(task)
+        return
+    pool = multiprocessing.Pool(processes)
+    if max_pending == None :
+        max_pending = pending_per_process * (processes or multiprocessing.cpu_count())
+    try :
+        pending = collections.deque()
+        for task in tasks :
+            pending.append(pool.apply_async(function, (task,)))
+            while len(pending) >= max_pending or (len(pending) > 0 and pending[0].ready()) :
+                yield pending.popleft().get()
+        while len(pending) > 0 :
+            yield pending.popleft().get()
+    finally :
+        pool.close()
+        pool.join()
+
+def run_scenarios(scenarios, output_path, processes=None, max_pending=None) :
+    """Run every scenario over a process pool and write one CSV row of
+    SCENARIO_FIELDS per scenario, in order, as they complete.  At most
+    max_pending scenarios are in flight.  processes=1 runs in this process.
+    Returns a dictionary of statistics."""
+    stats = {"scenarios" : 0, "ticks" : 0, "all_caught" : 0, "simulation_time" : 0.0}
+
+    def write_result(result, writer) :
+        """Write one scenario row and count it."""
+        stats["scenarios"] += 1
+        stats["ticks"] += result["ticks"]
+        stats["simulation_time"] += result["seconds"]
+        if result["all_caught_tick"] != None :
+            stats["all_caught"] += 1
+        writer.writerow(result)
+
+    start = time.time()
+    with open(output_path, "w", newline="") as output_file :
+        writer = csv.DictWriter(output_file, SCENARIO_FIELDS)
+        writer.writeheader()
+        with contextlib.closing(ordered_pool_map(run_scenario, scenarios, processes, max_pending)) as results :
+            for result in results :
+                write_result(result, writer)
+
+    stats["elapsed"] = time.time() - start
+    stats["ticks_per_sec"] = stats["ticks"] / stats["elapsed"] if stats["elapsed"] > 0 else 0.0
+    return stats
+
+def main(arguments) :
+    """Command line entry point: run random scenarios headless.  Returns an exit
+    code."""
+    parser = argparse.ArgumentParser(description="Run Zombie Apocalypse scenarios without the GUI.")
+    parser.add_argument("count", type=int, help="number of scenarios")
+    parser.add_argument("output", help="CSV file, one row per scenario")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-ticks", type=int, default=500)
+    parser.add_argument("--processes", type=int, default=None)
+    options = parser.parse_args(arguments)
+    scenarios = random_scenarios(options.count, options.seed, max_ticks=options.max_ticks)
+    stats = run_scenarios(scenarios, options.output, options.processes)
+    print(str(stats["scenarios"]) + " scenarios, " + str(stats["all_caught"]) + " with every human caught, " +
+          str(stats["ticks"]) + " ticks, " + str(round(stats["ticks_per_sec"], 1)) + " ticks/sec")
+    return 0
+
+# When run as a script, start interactive simulation, or run scenarios if
+# arguments are given.  Importing the module (or a worker process
+# re-importing it) does neither.
+if __name__ == "__main__" :
+    if poc_zombie_gui != None and len(sys.argv) == 1 :
+        poc_zombie_gui.run_gui(Apocalypse(30, 40))
+    else :
+        sys.exit(main(sys.argv[1:]))
\ No newline at end of file
@@ -0,0 +1,34 @@
+"""Fixtures for the game tests.  The games are single scripts rather than
+packages, and some names are not valid module names, so each one is loaded
+from its file."""
+
+import importlib.util
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def load_script(name, filename) :
+    """Load the script filename from the repository root as module name.
+    Returns the module."""
+    if name not in sys.modules :
+        spec = importlib.util.spec_from_file_location(name, os.path.join(ROOT, filename))
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[name] = module
+        spec.loader.exec_module(module)
+    return sys.modules[name]
+
+@pytest.fixture(scope="session")
+def fifteen() :
+    """The Fifteen module."""
+    return load_script("Fifteen", "Fifteen.py")
+
+@pytest.fixture(scope="session")
+def apocalypse() :
+    """The Zombie Apocalypse module, which needs the course's poc_grid and
+    poc_queue modules."""
+    pytest.importorskip("poc_grid")
+    pytest.importorskip("poc_queue")
+    return load_script("zombie_apocalypse", "Zombie Apocalypse.py")
@@ -0,0 +1,15 @@
+"""Tests for Fifteen.py."""
+
+def test_optimize_move_string_last_window_collapses(fifteen) :
+    """With window 8 to 10 the last segment of this walk is replaced by an
+    empty path, which used to leave no move to apply."""
+    puzzle = fifteen.Puzzle(2, 2, [[1, 3], [2, 0]])
+    walk = "udulrldruduldruldurldud"
+    expected = puzzle.clone()
+    expected.update_puzzle(walk)
+    for window in range(1, len(walk) + 1) :
+        optimized = puzzle.optimize_move_string(walk, window=window, max_time=None)
+        actual = puzzle.clone()
+        actual.update_puzzle(optimized)
+        assert str(actual) == str(expected)
+        assert len(optimized) <= len(walk)
@@ -0,0 +1,112 @@
+"""Tests for Zombie Apocalypse.py: the faster distance fields and moves are
+compared with the straightforward versions on seeded random maps."""
+
+import collections
+import random
+
+import pytest
+
+def random_maps(apocalypse, num_maps, sizes, obstacle_densities, num_entities, seed=0) :
+    """Generator that yields num_maps seeded random simulations, each with a
+    size, an obstacle density and numbers of humans and zombies drawn from
+    the given choices, together with the random generator, which can be
+    drawn from further."""
+    rng = random.Random(seed)
+    for dummy_map in range(num_maps) :
+        height, width = rng.choice(sizes)
+        yield rng, apocalypse.random_apocalypse(height, width, rng.choice(obstacle_densities),
+                                                rng.choice(num_entities), rng.choice(num_entities), rng)
+
+def reference_distance_field(apocalypse, simulation, entity_type) :
+    """The original breadth first search of compute_distance_field, a queue of
+    (row, col) cells with a set of visited cells.  Returns a 2D list."""
+    height = simulation.get_grid_height()
+    width = simulation.get_grid_width()
+    distance_field = [[height * width] * width for dummy_row in range(height)]
+    if entity_type == apocalypse.HUMAN :
+        boundary = collections.deque(simulation.humans())
+    else :
+        boundary = collections.deque(simulation.zombies())
+    visited = set(boundary)
+    for cell in boundary :
+        distance_field[cell[0]][cell[1]] = 0
+    while len(boundary) > 0 :
+        current_cell = boundary.popleft()
+        for neighbor_cell in simulation.four_neighbors(current_cell[0], current_cell[1]) :
+            if neighbor_cell not in visited and simulation.is_empty(neighbor_cell[0], neighbor_cell[1]) :
+                visited.add(neighbor_cell)
+                boundary.append(neighbor_cell)
+                distance_field[neighbor_cell[0]][neighbor_cell[1]] = distance_field[current_cell[0]][current_cell[1]] + 1
+    return distance_field
+
+def test_compute_distance_field_matches_reference(apocalypse) :
+    """Including 1x1 and one-row grids and maps without humans or zombies."""
+    for dummy_rng, simulation in random_maps(apocalypse, 100, ((1, 1), (1, 30), (30, 40), (60, 80)),
+                                             (0.0, 0.2, 0.4, 0.6), (0, 1, 10, 50)) :
+        for entity_type in (apocalypse.HUMAN, apocalypse.ZOMBIE) :
+            expected = reference_distance_field(apocalypse, simulation, entity_type)
+            assert simulation.compute_distance_field(entity_type) == expected
+
+def test_repair_distance_field_matches_recompute(apocalypse) :
+    """A human and a zombie field are kept over 50 ticks, on which the sources
+    move, humans are caught and up to three of each are added on random
+    cells, and repaired after every tick without the max_lost cutoff."""
+    for rng, simulation in random_maps(apocalypse, 10, ((30, 40), (60, 80)), (0.0, 0.2, 0.4), (1, 10, 50)) :
+        entity_types = (apocalypse.HUMAN, apocalypse.ZOMBIE)
+        kept = dict((entity_type, simulation.compute_distance_field(entity_type)) for entity_type in entity_types)
+        old_sources = {apocalypse.HUMAN : set(simulation.humans()), apocalypse.ZOMBIE : set(simulation.zombies())}
+        for dummy_tick in range(50) :
+            simulation.step()
+            for add_entity in (simulation.add_human, simulation.add_zombie) :
+                for dummy_added in range(rng.randint(0, 3)) :
+                    row = rng.randrange(simulation.get_grid_height())
+                    col = rng.randrange(simulation.get_grid_width())
+                    if simulation.is_empty(row, col) :
+                        add_entity(row, col)
+            sources = {apocalypse.HUMAN : set(simulation.humans()), apocalypse.ZOMBIE : set(simulation.zombies())}
+            for entity_type in entity_types :
+                field = kept[entity_type]
+                assert simulation.repair_distance_field(field, old_sources[entity_type] - sources[entity_type],
+                                                        sources[entity_type] - old_sources[entity_type])
+                assert field == simulation.compute_distance_field(entity_type)
+            old_sources = sources
+
+def test_distance_field_of_other_types_is_not_kept(apocalypse) :
+    """Types other than humans and zombies have no sources, so every cell is
+    unreachable."""
+    simulation = apocalypse.random_apocalypse(5, 6, rng=random.Random(0))
+    field = simulation.distance_field(apocalypse.OBSTACLE)
+    assert field == [[30] * 6 for dummy_row in range(5)]
+    assert simulation.distance_field(apocalypse.OBSTACLE) is not field
+
+def test_move_positions_matches_loops(apocalypse) :
+    """Over 50 ticks the humans, then the zombies, are moved by both the loops
+    and move_positions, without catching, and must end on the same cells."""
+    if apocalypse.np == None :
+        pytest.skip("move_positions needs NumPy.")
+    for dummy_rng, simulation in random_maps(apocalypse, 20, ((30, 40), (60, 80)), (0.0, 0.2, 0.4), (1, 10, 100)) :
+        for dummy_tick in range(50) :
+            field = simulation.distance_field(apocalypse.ZOMBIE)
+            expected = simulation.move_positions(apocalypse.entity_array(list(simulation.humans())),
+                                                 field, apocalypse.EIGHT_STEPS, False)
+            simulation.move_humans(field, vectorize=False)
+            assert list(simulation.humans()) == apocalypse.entity_list(expected)
+            field = simulation.distance_field(apocalypse.HUMAN)
+            expected = simulation.move_positions(apocalypse.entity_array(list(simulation.zombies())),
+                                                 field, apocalypse.FOUR_STEPS, True)
+            simulation.move_zombies(field, vectorize=False)
+            assert list(simulation.zombies()) == apocalypse.entity_list(expected)
+
+def test_distance_field_with_numpy_matches_reference(apocalypse, monkeypatch) :
+    """With every grid large enough for NumPy, the kept fields, computed by
+    compute_distance_array and then repaired, still match over 20 ticks."""
+    if apocalypse.np == None :
+        pytest.skip("compute_distance_array needs NumPy.")
+    monkeypatch.setattr(apocalypse, "DISTANCE_ARRAY_MIN_CELLS", 0)
+    for dummy_rng, simulation in random_maps(apocalypse, 10, ((1, 1), (1, 30), (30, 40)),
+                                             (0.0, 0.2, 0.4), (0, 1, 10, 50)) :
+        for dummy_tick in range(20) :
+            for entity_type in (apocalypse.HUMAN, apocalypse.ZOMBIE) :
+                expected = reference_distance_field(apocalypse, simulation, entity_type)
+                assert simulation.distance_field(entity_type) == expected
+            simulation.step()